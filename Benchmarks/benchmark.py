@@ -0,0 +1,357 @@
+from pathlib import Path
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import cv2
+
+# benchmarks the gcode generator and both CV analyzers on synthetic inputs with known answers
+# every case runs in a fresh process so its peak memory is its own, and reports the time of each pipeline stage,
+# its peak memory, and accuracy checks against the ground truth the inputs were generated from
+# results are written to results.json and compared against the stored baselines of the same preset
+
+REPO_FOLDER = Path(__file__).parent.parent
+GCODE_FOLDER = REPO_FOLDER / "Gcode Generator"
+NODE_FOLDER = REPO_FOLDER / "Node Position CV Analyzer"
+SAMPLE_FOLDER = REPO_FOLDER / "Sample Dimension CV Measurer"
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+RESULTS_PATH = Path(__file__).parent / "results.json"
+
+TIME_TOLERANCE = 0.5        # a stage is flagged if it gets this fraction slower than its baseline
+TIME_NOISE_FLOOR = 0.05     # s, and slower by more than this
+MEMORY_TOLERANCE = 0.25     # peak memory is flagged if it grows by this fraction over its baseline
+
+# synthetic printer setup, so the benchmarks don't depend on the local materialData folder
+MATERIAL_DATA = [{"axis_name": "A", "x_home_position": 0, "y_home_position": 0, "pressure_COM": 5, "dwell_time": 0.2},
+                 {"axis_name": "B", "x_home_position": 50.5, "y_home_position": -3.25, "pressure_COM": 6, "dwell_time": 0.3}]
+MAPPING_SPEEDS = [2, 4, 6, 8, 10]           # mm/s
+MAPPING_PRESSURES = [30, 40, 50, 60, 70]    # psi
+LATTICE_PITCH = 5.0     # mm between neighbouring nodes of a synthetic network
+
+PLATE_SCALE_FACTOR = 41.9   # pixels per mm the synthetic images are drawn at, same as the analyzers
+PLATE_NODE_PITCH = 4.0      # mm between neighbouring nodes on a synthetic plate
+PLATE_NODE_SIZE = 0.7       # mm, side of a node square
+PLATE_ROTATION = 1.5        # degrees the plate is rotated by in the image
+
+# accuracy limits the ground truth checks are held to
+MAX_NODE_ERROR_MM = 0.05
+MAX_SAMPLE_ERROR_MM = 0.06
+
+# sizes of the synthetic inputs, lattice sizes are nodes per side (a size n lattice has 2n(n-1) edges), gcode_match is the lattice both backends are compared on
+PRESETS = {
+    'small': {'gcode': [('mecode', 10), ('stream', 10), ('stream', 40)], 'gcode_match': 10, 'layers': 2, 'numpaths_xy': 3, 'material_mix': 0.5,
+              'plate_px': (2400, 3200), 'samples': 12},
+    'large': {'gcode': [('mecode', 40), ('stream', 40), ('stream', 150), ('stream', 225)], 'gcode_match': 40, 'layers': 3, 'numpaths_xy': 4, 'material_mix': 0.5,
+              'plate_px': (6000, 9000), 'samples': 40},
+}
+
+# imports a module from a file, with its folder on the path so its own imports work
+def load_module(name, path):
+    sys.path.insert(0, str(Path(path).parent))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# returns the peak resident memory of this process in MB, or None where the resource module doesn't exist (windows)
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10    # bytes on macOS, KB on linux
+
+def check(value, limit, passed):
+    return {'value': value, 'limit': limit, 'passed': bool(passed)}
+
+# writes a speed pressure mapping per material, print variables vary smoothly with speed and pressure
+def make_mappings(folder):
+    paths = []
+    for material_index in range(len(MATERIAL_DATA)):
+        speed, pressure = np.meshgrid(MAPPING_SPEEDS, MAPPING_PRESSURES, indexing='ij')
+        mapping_df = pd.DataFrame({'print_speed_mmps': speed.ravel(), 'print_pressure_psi': pressure.ravel()})
+        mapping_df['firstlayerheight_mm'] = 0.2 + 0.002 * mapping_df['print_pressure_psi'] - 0.005 * mapping_df['print_speed_mmps']
+        mapping_df['z_layerheight_mm'] = mapping_df['firstlayerheight_mm'] + 0.02 * material_index
+        mapping_df['xy_spacing_mm'] = 0.3 + 0.003 * mapping_df['print_pressure_psi'] - 0.01 * mapping_df['print_speed_mmps']
+        paths.append(Path(folder) / f"material{material_index + 1}_speed_pressure_mappings.csv")
+        mapping_df.to_csv(paths[-1], index=False)
+    return paths
+
+# writes a size x size lattice network as <name>_Nodes.csv and <name>_Edges.csv, returns the edges path and edge dataframe
+# material_mix is the fraction of edges printed with material 1, speeds and pressures are drawn from the mapped values
+def make_lattice_network(folder, name, size, layers, numpaths_xy, material_mix, seed=0):
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.arange(size) * LATTICE_PITCH, np.arange(size) * LATTICE_PITCH)
+    node_df = pd.DataFrame({'x': x.ravel(), 'y': y.ravel()})
+
+    node = np.arange(size * size).reshape(size, size) + 1     # node numbers start at 1
+    ends = np.vstack([np.column_stack([node[:, :-1].ravel(), node[:, 1:].ravel()]),
+                      np.column_stack([node[:-1, :].ravel(), node[1:, :].ravel()])])
+    edge_df = pd.DataFrame({'EndNodes_1': ends[:, 0], 'EndNodes_2': ends[:, 1],
+                            'stimulus': (rng.random(len(ends)) < material_mix).astype(int),
+                            'print_speed_mmps': rng.choice(MAPPING_SPEEDS, len(ends)),
+                            'print_pressure_psi': rng.choice(MAPPING_PRESSURES, len(ends)),
+                            'numpaths_xy': numpaths_xy,
+                            'numlayers_z': rng.integers(1, layers + 1, len(ends))})
+
+    edges_path = Path(folder) / f"{name}_Edges.csv"
+    node_df.to_csv(Path(folder) / f"{name}_Nodes.csv", index=False)
+    edge_df.to_csv(edges_path, index=False)
+    return edges_path, edge_df
+
+# draws a plate of node squares on a light, noisy background, rotated by PLATE_ROTATION and with the y axis pointing up like the design
+# returns the image and the (n, 2) design node positions in mm and the (n, 2) pixel positions they were drawn at
+def make_plate_image(height_px, width_px, seed=0):
+    rng = np.random.default_rng(seed)
+    margin = 3.0    # mm
+    columns = int((width_px / PLATE_SCALE_FACTOR - 2 * margin) / PLATE_NODE_PITCH)
+    rows = int((height_px / PLATE_SCALE_FACTOR - 2 * margin) / PLATE_NODE_PITCH)
+    x, y = np.meshgrid(np.arange(columns) * PLATE_NODE_PITCH, np.arange(rows) * PLATE_NODE_PITCH)
+    design = np.column_stack([x.ravel(), y.ravel()]) + rng.normal(0, 0.3, (columns * rows, 2))    # irregular, like a printed network
+
+    theta = np.radians(PLATE_ROTATION)
+    R = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    centered = design - design.mean(axis=0)
+    pixels = (centered @ R.T) * PLATE_SCALE_FACTOR * [1, -1] + [width_px / 2, height_px / 2]
+
+    img = np.full((height_px, width_px, 3), 225, np.uint8)
+    img += rng.integers(0, 25, img.shape, dtype=np.uint8)
+    side = PLATE_NODE_SIZE * PLATE_SCALE_FACTOR
+    for px, py in pixels:
+        box = cv2.boxPoints(((px, py), (side, side), PLATE_ROTATION))
+        cv2.fillPoly(img, [np.round(box * 16).astype(np.int32)], (25, 25, 25), lineType=cv2.LINE_AA, shift=4)
+    return img, design, pixels
+
+# draws rotated rectangular samples of known size, returns the image and a table of their centers (px) and sizes (mm)
+def make_sample_image(height_px, width_px, count, seed=0):
+    rng = np.random.default_rng(seed)
+    img = np.full((height_px, width_px, 3), 215, np.uint8)
+    cells = int(np.ceil(np.sqrt(count)))
+    cell_w, cell_h = width_px / cells, height_px / cells
+    samples = []
+    for i in range(count):
+        center = ((i % cells + 0.5) * cell_w, (i // cells + 0.5) * cell_h)
+        w_mm, h_mm = sorted(rng.uniform(1, 0.5 * min(cell_w, cell_h) / PLATE_SCALE_FACTOR, 2))
+        angle = rng.uniform(0, 90)
+        box = cv2.boxPoints((center, (w_mm * PLATE_SCALE_FACTOR, h_mm * PLATE_SCALE_FACTOR), angle))
+        cv2.fillPoly(img, [np.round(box * 16).astype(np.int32)], (35, 35, 35), shift=4)
+        samples.append((center[0], center[1], w_mm, h_mm))
+    return img, pd.DataFrame(samples, columns=['x_px', 'y_px', 'w_mm', 'h_mm'])
+
+# generates the gcode of a size x size lattice network with the given backend
+# checks that every layer of every edge was printed by counting the pressure toggles in the program
+def bench_gcode(backend, size, layers, numpaths_xy, material_mix):
+    sys.path.insert(0, str(GCODE_FOLDER))
+    from generateGcode_bylayer import NetworkGcodeGenerator
+
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        mapping_paths = make_mappings(folder)
+        edges_path, edge_df = make_lattice_network(folder, 'lattice', size, layers, numpaths_xy, material_mix)
+        setup = time.perf_counter() - start
+
+        generator = NetworkGcodeGenerator(input_folder=Path(folder), output_folder=Path(folder), mapping_paths=mapping_paths,
+                                          backend=backend, use_cache=False, material_data=MATERIAL_DATA)
+        outpath = Path(folder) / 'lattice_bylayer.pgm'
+        start = time.perf_counter()
+        report = generator.generate_network_gcode(edges_path, outpath)
+        total = time.perf_counter() - start
+
+        toggles = outpath.read_bytes().count(b'Call togglePress P')
+        expected = 2 * int(edge_df['numlayers_z'].sum())   # on and off once per printed layer
+        size_mb = outpath.stat().st_size / 2**20
+
+    return {'stages': {**report['timings'], 'total': total},
+            'info': {'edges': len(edge_df), 'print_jobs': expected // 2, 'program_mb': size_mb, 'setup_s': setup},
+            'checks': {'pressure_toggles': check(toggles, expected, toggles == expected)}}
+
+# generates the same lattice network with both backends, once with the default settings and once with travel optimization and material batching
+# checks that the streaming backend writes the same program as mecode, byte for byte
+def bench_gcode_match(size, layers, numpaths_xy, material_mix):
+    sys.path.insert(0, str(GCODE_FOLDER))
+    from generateGcode_bylayer import NetworkGcodeGenerator
+
+    stages, checks = {}, {}
+    with tempfile.TemporaryDirectory() as folder:
+        mapping_paths = make_mappings(folder)
+        edges_path, edge_df = make_lattice_network(folder, 'lattice', size, layers, numpaths_xy, material_mix)
+        for settings_name, settings in [('default', {}), ('travel', {'optimize_travel': True, 'material_batching': 'carry'})]:
+            programs = {}
+            for backend in ['mecode', 'stream']:
+                generator = NetworkGcodeGenerator(input_folder=Path(folder), output_folder=Path(folder), mapping_paths=mapping_paths,
+                                                  backend=backend, use_cache=False, material_data=MATERIAL_DATA, **settings)
+                outpath = Path(folder) / f'lattice_{settings_name}_{backend}.pgm'
+                start = time.perf_counter()
+                generator.generate_network_gcode(edges_path, outpath)
+                stages[f'{settings_name}_{backend}'] = time.perf_counter() - start
+                programs[backend] = outpath.read_bytes()
+            identical = programs['mecode'] == programs['stream']
+            checks[f'identical_programs_{settings_name}'] = check(identical, True, identical)
+
+    return {'stages': stages, 'info': {'edges': len(edge_df)}, 'checks': checks}
+
+# finds and matches the nodes of a synthetic plate, checks every node is found, matched to the right design node, and measured accurately
+def bench_node_position(height_px, width_px):
+    analyze = load_module('node_analyze', NODE_FOLDER / 'analyze.py')
+    from matchNodes import match_nodes
+    from scipy.spatial import cKDTree
+
+    img, design, pixels = make_plate_image(height_px, width_px)
+    with tempfile.TemporaryDirectory() as folder:
+        image_path = Path(folder) / 'plate.JPG'
+        cv2.imwrite(str(image_path), img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        del img
+
+        stages = {}
+        start = time.perf_counter()
+        img = cv2.imread(str(image_path))
+        stages['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = analyze.detect_nodes(img.copy(), annotate=False)
+    stages['detect'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tiled = analyze.detect_nodes(img.copy(), annotate=False, tile_height=max(img.shape[0] // 8, 1))
+    stages['detect_tiled'] = time.perf_counter() - start
+
+    detected = np.array(list(data.values()), dtype=float).reshape(-1, 2)
+    start = time.perf_counter()
+    table, summary = match_nodes(detected, design)
+    stages['match'] = time.perf_counter() - start
+
+    # the design node each detection really is, from where it was drawn
+    distance, truth = cKDTree(pixels / analyze.SCALE_FACTOR).query(detected)
+    matched = table['index'].to_numpy() >= 0
+    correct = np.mean(table['node'].to_numpy()[matched] == truth[table['index'].to_numpy()[matched]] + 1)
+
+    return {'stages': stages,
+            'info': {'nodes': len(design), 'image_mp': height_px * width_px / 1e6},
+            'checks': {'detected': check(len(detected), len(design), len(detected) == len(design)),
+                       'tiled_matches_untiled': check(tiled == data, True, tiled == data),
+                       'matched': check(summary['matched'], len(design), summary['matched'] == len(design)),
+                       'correct_matches': check(float(correct), 1.0, correct == 1.0),
+                       'rms_error_mm': check(summary['rms_error_mm'], MAX_NODE_ERROR_MM, summary['rms_error_mm'] <= MAX_NODE_ERROR_MM)}}
+
+# measures a synthetic image of samples, checks every sample is found and its width and height are measured accurately
+def bench_sample_dimension(height_px, width_px, count):
+    analyze = load_module('sample_analyze', SAMPLE_FOLDER / 'analyze.py')
+    from scipy.spatial import cKDTree
+
+    img, truth = make_sample_image(height_px, width_px, count)
+    stages = {}
+    with tempfile.TemporaryDirectory() as folder:
+        image_path = Path(folder) / 'samples.JPG'
+        cv2.imwrite(str(image_path), img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        start = time.perf_counter()
+        img = cv2.imread(str(image_path))
+        stages['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, _, samples = analyze.measure_samples(img, annotate=False)
+    stages['measure'] = time.perf_counter() - start
+
+    measured = pd.DataFrame(samples, columns=analyze.MEASUREMENT_COLUMNS)
+    _, nearest = cKDTree(measured[['x_mm', 'y_mm']].to_numpy() * analyze.SCALE_FACTOR).query(truth[['x_px', 'y_px']].to_numpy())
+    error = np.maximum(np.abs(measured['w_mm'].to_numpy()[nearest] - truth['w_mm']), np.abs(measured['h_mm'].to_numpy()[nearest] - truth['h_mm']))
+    return {'stages': stages,
+            'info': {'samples': count, 'image_mp': height_px * width_px / 1e6},
+            'checks': {'measured': check(len(measured), count, len(measured) == count),
+                       'max_error_mm': check(float(error.max()), MAX_SAMPLE_ERROR_MM, error.max() <= MAX_SAMPLE_ERROR_MM)}}
+
+# returns the (name, function, kwargs) of every case of a preset
+def benchmark_cases(preset):
+    settings = PRESETS[preset]
+    cases = [(f"gcode_{backend}_{size}x{size}", bench_gcode,
+              {'backend': backend, 'size': size, 'layers': settings['layers'], 'numpaths_xy': settings['numpaths_xy'], 'material_mix': settings['material_mix']})
+             for backend, size in settings['gcode']]
+    size = settings['gcode_match']
+    cases.append((f"gcode_match_{size}x{size}", bench_gcode_match,
+                  {'size': size, 'layers': settings['layers'], 'numpaths_xy': settings['numpaths_xy'], 'material_mix': settings['material_mix']}))
+    height_px, width_px = settings['plate_px']
+    cases.append(("node_position", bench_node_position, {'height_px': height_px, 'width_px': width_px}))
+    cases.append(("sample_dimension", bench_sample_dimension, {'height_px': height_px, 'width_px': width_px, 'count': settings['samples']}))
+    return cases
+
+# runs a case in a fresh process and adds its peak memory to its result
+def run_case(function, kwargs):
+    result = function(**kwargs)
+    result['peak_memory_mb'] = peak_memory_mb()
+    return result
+
+# compares results to baselines, returns a list of messages about stages that got slower, memory that grew, and failed checks
+def find_regressions(results, baselines):
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        for check_name, outcome in result['checks'].items():
+            if not outcome['passed']:
+                regressions.append(f"{name}: check {check_name} failed ({outcome['value']} against {outcome['limit']})")
+        if baseline is None:
+            continue
+        for stage, seconds in result['stages'].items():
+            before = baseline['stages'].get(stage)
+            if before is not None and seconds > before * (1 + TIME_TOLERANCE) and seconds - before > TIME_NOISE_FLOOR:
+                regressions.append(f"{name}: {stage} took {seconds:.3f} s, baseline {before:.3f} s")
+        memory, before = result['peak_memory_mb'], baseline.get('peak_memory_mb')
+        if memory is not None and before is not None and memory > before * (1 + MEMORY_TOLERANCE):
+            regressions.append(f"{name}: peak memory {memory:.0f} MB, baseline {before:.0f} MB")
+    return regressions
+
+def run_benchmarks(preset='small', only=None, update_baselines=False, results_path=RESULTS_PATH, baselines_path=BASELINES_PATH):
+    cases = [case for case in benchmark_cases(preset) if only is None or any(name in case[0] for name in only)]
+    results = {}
+    context = multiprocessing.get_context('spawn')  # a fresh interpreter per case, so peak memory doesn't carry over
+    for name, function, kwargs in cases:
+        print(f"Running {name}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(run_case, function, kwargs).result()
+        result = results[name]
+        memory = f", peak memory {result['peak_memory_mb']:.0f} MB" if result['peak_memory_mb'] is not None else ""
+        print("  " + ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in result['stages'].items()) + memory)
+        for check_name, outcome in result['checks'].items():
+            print(f"  {check_name}: {outcome['value']} ({'ok' if outcome['passed'] else 'FAILED'})")
+
+    baselines = {}
+    if Path(baselines_path).exists():
+        with open(baselines_path) as fd:
+            baselines = json.load(fd)
+    regressions = find_regressions(results, baselines.get(preset, {}))
+
+    with open(results_path, 'w') as fd:
+        json.dump({'preset': preset, 'date': datetime.now().isoformat(timespec='seconds'),
+                   'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'python': platform.python_version()},
+                   'cases': results, 'regressions': regressions}, fd, indent=4)
+    print(f"\nResults written to {results_path}")
+
+    if update_baselines:
+        baselines[preset] = {**baselines.get(preset, {}),
+                             **{name: {'stages': result['stages'], 'peak_memory_mb': result['peak_memory_mb']} for name, result in results.items()}}
+        with open(baselines_path, 'w') as fd:
+            json.dump(baselines, fd, indent=4)
+        print(f"Baselines updated in {baselines_path}")
+
+    for regression in regressions:
+        print(f"  REGRESSION {regression}")
+    print(f"{len(regressions)} regressions against the {preset} baselines")
+    return results, regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks gcode generation and the CV analyzers on synthetic inputs.")
+    parser.add_argument('--preset', choices=list(PRESETS), default='small', help="size of the synthetic inputs")
+    parser.add_argument('--only', nargs='+', default=None, help="only run the cases whose names contain one of these")
+    parser.add_argument('--update-baselines', action='store_true', help="store these results as the new baselines")
+    parser.add_argument('--output', type=Path, default=RESULTS_PATH, help="file the results are written to")
+    args = parser.parse_args()
+
+    _, regressions = run_benchmarks(args.preset, only=args.only, update_baselines=args.update_baselines, results_path=args.output)
+    sys.exit(1 if regressions else 0)
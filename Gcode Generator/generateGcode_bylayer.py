@@ -1,141 +1,345 @@
 from pathlib import Path
-from utils.gcodeLibrary import gcodeLibrary   # gcodeLibrary.py must be in the same directory as this file
+from utils.gcodeLibrary import gcodeLibrary, material_data, printer_constants   # gcodeLibrary.py must be in the same directory as this file
+from utils.layerScheduler import LayerScheduler
+from utils.travelOptimizer import TravelOptimizer
+from utils.networkData import find_networks, network_name, network_files, load_network, save_network, network_arrays
+from utils.buildCache import BuildCache, hash_inputs
 import pandas as pd
-from collections import defaultdict
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import time
+
+# mapping paths for the two materials ordered by material index
+MAPPING_PATHS = [Path(__file__).parent / "utils" / "materialData" / "material1_speed_pressure_mappings.csv",
+                 Path(__file__).parent / "utils" / "materialData" / "material2_speed_pressure_mappings.csv"]
+MAPPING_KEYS = ['material_index', 'print_speed_mmps', 'print_pressure_psi']     # columns the mappings are looked up by
+MAPPING_COLUMNS = ['xy_spacing_mm', 'firstlayerheight_mm', 'z_layerheight_mm']  # print variables read from the mappings
+
+# linearly interpolates the print variables of a speed/pressure pair that falls between calibrated rows of a material
+# interpolates along pressure at the calibrated speeds bracketing the requested speed, then along speed
+# returns None if the pair is outside of the calibrated range
+def interpolate_mapping(mapping_df, material_index, print_speed_mmps, print_pressure_psi):
+    try:
+        material_df = mapping_df.xs(material_index, level='material_index')
+    except KeyError:
+        return None
+
+    speeds = np.unique(material_df.index.get_level_values('print_speed_mmps'))
+    i = np.searchsorted(speeds, print_speed_mmps)
+    if i < len(speeds) and speeds[i] == print_speed_mmps:
+        bracket = [speeds[i]]
+    elif 0 < i < len(speeds):
+        bracket = [speeds[i - 1], speeds[i]]
+    else:
+        return None
+
+    rows = []
+    for speed in bracket:
+        speed_df = material_df.xs(speed, level='print_speed_mmps')
+        pressures = speed_df.index.to_numpy()
+        if print_pressure_psi < pressures[0] or print_pressure_psi > pressures[-1]:
+            return None
+        rows.append(np.array([np.interp(print_pressure_psi, pressures, speed_df[column].to_numpy()) for column in MAPPING_COLUMNS]))
+
+    if len(rows) == 1:
+        return rows[0]
+    t = (print_speed_mmps - bracket[0]) / (bracket[1] - bracket[0])
+    return (1 - t) * rows[0] + t * rows[1]
+
+# prints the report returned by NetworkGcodeGenerator.generate_network_gcode
+def print_report(report):
+    if 'toolpath' in report:
+        toolpath = report['toolpath']
+        print(f"Estimated print time: {toolpath['estimated_time_s'] / 60:.1f} min "
+              f"({toolpath['print_time_s']:.1f} s printing, {toolpath['travel_time_s']:.1f} s travelling, {toolpath['dwell_time_s']:.1f} s dwelling)")
+        for material_index, length in toolpath['extruded_mm'].items():
+            print(f"  material {material_index} extruded: {length:.1f} mm")
+        print(f"  travel: {toolpath['travel_xy_mm']:.1f} mm in xy, {toolpath['travel_z_mm']:.1f} mm in z")
+        print(f"  material swaps: {toolpath['material_swaps']}, pressure toggles: {toolpath['pressure_toggles']}, pressure changes: {toolpath['pressure_sets']}")
+    print("Generation time: " + ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in report['timings'].items()))
 
 class NetworkGcodeGenerator: 
-    def __init__(self, input_folder=Path(__file__).parent / "Input", output_folder=Path(__file__).parent / "Output") -> None:
+    def __init__(self, input_folder=Path(__file__).parent / "Input", output_folder=Path(__file__).parent / "Output", 
+                 mapping_paths=MAPPING_PATHS, interpolate_mappings=False, optimize_travel=False, material_batching='off', backend='mecode', write_back=False, 
+                 use_cache=True, cache_max_bytes=256 * 2**20, material_data=material_data, skip_redundant=True, peephole=True) -> None:
         self.input_folder = input_folder
         self.output_folder = output_folder
+        self.mapping_paths = mapping_paths
+        self.interpolate_mappings = interpolate_mappings    # if true, speed/pressure pairs between calibrated rows are linearly interpolated
+        self._mapping_df = None     # mappings are read once per generator and cached here
+        self.optimize_travel = optimize_travel  # if true, edges within each speed/layer group are reordered to minimize travel
+        self.material_batching = material_batching  # policy for batching edges by material within each speed/layer group, see LayerScheduler
+        self.backend = backend  # gcodeLibrary backend used to write the gcode
+        self.write_back = write_back    # if true, the print variables are written back to the input file
+        self.use_cache = use_cache  # if true, generate_all skips networks whose inputs are unchanged, see BuildCache
+        self.cache_max_bytes = cache_max_bytes
+        self.material_data = material_data  # per material settings passed to gcodeLibrary, defaults to utils/materialData/material_data.json
+        self.skip_redundant = skip_redundant    # if true, pressure, dwell and feed commands that repeat the printer's state are left out, see gcodeLibrary
+        self.peephole = peephole    # if true, no-op moves and redundant mode switches are left out of the program, see gcodeLibrary
 
-    # uses speed pressure mappings to find h, meander spacing, and layer spacing and add to input excel file
-    def add_print_variables(self, inpath):
-        # mapping paths for the two materials ordered by material index
-        mapping_paths = ["Gcode Generator/utils/materialData/material1_speed_pressure_mappings.csv",
-                         "Gcode Generator/utils/materialData/material2_speed_pressure_mappings.csv"]
-
-        mapping_dfs = [pd.read_csv(mapping_path) for mapping_path in mapping_paths]
-        df = pd.read_excel(io=inpath, sheet_name=['Nodes','Edges']) # reads in the two sheets of the excel file
-        node_df = df['Nodes']
-        edge_df = df['Edges']
-
-        flheights = []
-        lheights = []
-        spacings = []
-        
-        for index, row in edge_df.iterrows():
-            # parses information from the edge dataframe
-            try:
-                material_index = int(row['stimulus'])
-            except:
-                material_index = 0    # if the stimulus column doesn't exist, assume single material print
-
-            mapping_df = mapping_dfs[material_index]    # selects the correct mapping dataframe based on the material index
-            
-            print_speed_mmps = row['print_speed_mmps']
-            print_pressure_psi = row['print_pressure_psi']
-
-            try:
-                mapping = mapping_df[(mapping_df['print_speed_mmps'] == print_speed_mmps) & 
-                                     (mapping_df['print_pressure_psi'] == print_pressure_psi)].iloc[0]
-            except:
-                raise KeyError(f"Mapping for speed {print_speed_mmps} and pressure {print_pressure_psi} for material index {material_index} not found. \
-                               Please check mappings sheet under utils and try again.")
-                
-            flheights.append(mapping['firstlayerheight_mm'])
-            lheights.append(mapping['z_layerheight_mm'])
-            spacings.append(mapping['xy_spacing_mm'])
+    # loads the speed pressure mappings of all materials into one table indexed by (material index, speed, pressure)
+    def load_mappings(self):
+        if self._mapping_df is None:
+            mapping_dfs = []
+            for material_index, mapping_path in enumerate(self.mapping_paths):
+                mapping_df = pd.read_csv(mapping_path)
+                mapping_df.insert(0, 'material_index', material_index)
+                mapping_dfs.append(mapping_df)
+            mapping_df = pd.concat(mapping_dfs, ignore_index=True)
+            mapping_df['print_speed_mmps'] = mapping_df['print_speed_mmps'].astype(float)
+            mapping_df['print_pressure_psi'] = mapping_df['print_pressure_psi'].astype(float)
+
+            # keeps the first row of duplicated speed/pressure pairs, same as the previous row-by-row lookup
+            mapping_df = mapping_df.drop_duplicates(subset=MAPPING_KEYS, keep='first')
+            self._mapping_df = mapping_df.set_index(MAPPING_KEYS)[MAPPING_COLUMNS].sort_index()
+        return self._mapping_df
+
+    # looks up the print variables of every edge with a single keyed join against the mapping table
+    # returns a dataframe with the MAPPING_COLUMNS aligned to the rows of edge_df
+    def lookup_print_variables(self, edge_df):
+        mapping_df = self.load_mappings()
+
+        # if the stimulus column doesn't exist, assume single material print
+        if 'stimulus' in edge_df.columns:
+            material_index = pd.to_numeric(edge_df['stimulus'], errors='coerce').fillna(0).astype(int)
+        else:
+            material_index = pd.Series(0, index=edge_df.index)
+
+        keys = pd.MultiIndex.from_arrays([material_index.to_numpy(), 
+                                          edge_df['print_speed_mmps'].astype(float).to_numpy(), 
+                                          edge_df['print_pressure_psi'].astype(float).to_numpy()], names=MAPPING_KEYS)
+        mapped = mapping_df.reindex(keys)
+
+        missing = mapped.isna().any(axis=1).to_numpy()
+        if missing.any() and self.interpolate_mappings:
+            # interpolates each missing speed/pressure pair once, no matter how many edges use it
+            interpolated = {}
+            for key in keys[missing].unique():
+                values = interpolate_mapping(mapping_df, *key)
+                if values is not None:
+                    interpolated[key] = values
+
+            if interpolated:
+                interpolated_df = pd.DataFrame(list(interpolated.values()), columns=MAPPING_COLUMNS,
+                                               index=pd.MultiIndex.from_tuples(list(interpolated.keys()), names=MAPPING_KEYS))
+                values = mapped.to_numpy()
+                values = np.where(np.isnan(values), interpolated_df.reindex(keys).to_numpy(), values)
+                mapped = pd.DataFrame(values, columns=MAPPING_COLUMNS, index=keys)
+            missing = mapped.isna().any(axis=1).to_numpy()
+
+        if missing.any():
+            material_index, print_speed_mmps, print_pressure_psi = keys[missing][0]
+            raise KeyError(f"Mapping for speed {print_speed_mmps} and pressure {print_pressure_psi} for material index {material_index} not found. \
+                           Please check mappings sheet under utils and try again.")
+
+        mapped.index = edge_df.index
+        return mapped
+
+    # uses speed pressure mappings to find h, meander spacing, and layer spacing and adds them to the edges
+    # returns the node and edge dataframes, which are only written back to the input file if write_back is true
+    def add_print_variables(self, inpath, write_back=False):
+        node_df, edge_df = load_network(inpath)
+        edge_df = self.enrich_edges(edge_df)
+        if write_back:
+            save_network(inpath, node_df, edge_df)
+        return node_df, edge_df
+
+    # adds the mapped print variables to an edge dataframe and sorts it into print order
+    def enrich_edges(self, edge_df):
+        mapped = self.lookup_print_variables(edge_df)
 
         # adds new print data columns. if columns already exist, they are overwritten instead
         try:
-            edge_df.insert(2, 'xy_spacing_mm', spacings)
-            edge_df.insert(3, 'firstlayerheight_mm', flheights)
-            edge_df.insert(4, 'z_layerheight_mm', lheights)
+            edge_df.insert(2, 'xy_spacing_mm', mapped['xy_spacing_mm'])
+            edge_df.insert(3, 'firstlayerheight_mm', mapped['firstlayerheight_mm'])
+            edge_df.insert(4, 'z_layerheight_mm', mapped['z_layerheight_mm'])
         except:
-            edge_df['xy_spacing_mm'] = spacings
-            edge_df['firstlayerheight_mm'] = flheights
-            edge_df['z_layerheight_mm'] = lheights
+            edge_df['xy_spacing_mm'] = mapped['xy_spacing_mm']
+            edge_df['firstlayerheight_mm'] = mapped['firstlayerheight_mm']
+            edge_df['z_layerheight_mm'] = mapped['z_layerheight_mm']
 
         # sorts the edges by print speed, fastest to slowest, to prevent material dragging
         try:
             edge_df.sort_values(by=['print_speed_mmps','stimulus'], ascending=[False, True], inplace=True)
         except:
             edge_df.sort_values(by=['print_speed_mmps'], ascending=[False], inplace=True)
-
-        with pd.ExcelWriter(inpath) as writer:
-            node_df.to_excel(writer, sheet_name='Nodes', index=False)
-            edge_df.to_excel(writer, sheet_name='Edges', index=False)
+        edge_df.reset_index(drop=True, inplace=True)
+        return edge_df
 
     # generates the gcode to print the active/passive network
-    def generate_network_gcode(self, inpath, outpath, view=False): 
-        self.add_print_variables(inpath)    # generates print parameters 
-        df = pd.read_excel(inpath,['Nodes','Edges']) # reads in the two sheets of the excel file
-        node_df = df['Nodes']
-        edge_df = df['Edges']
-        g = gcodeLibrary(outpath)
-
-        # sets up data structures for layer by layer printing
-        all_edges_dict = defaultdict(list) # grouped by speed
-
-        # loops through all edges in the dataframe and reads in parameters
-        for index, row in edge_df.iterrows():
-            edge = {"edge_index": index, "layer_index_z": 1}    # dictionary with all the edge data
-        
-            try:    # if the stimulus column doesn't exist, assume single material print
-                edge['material_index'] = int(row['stimulus'])
-            except:
-                edge['material_index'] = 0
-
-            edge['node1_position'] = node_df.iloc[int(row['EndNodes_1']) - 1]    # subtract 1 because node numbers start at 1 in the excel file and dataframes are zero-indexed
-            edge['node2_position'] = node_df.iloc[int(row['EndNodes_2']) - 1]
-
-            edge['print_speed_mmps'] = row['print_speed_mmps']
-            edge['print_pressure_psi'] = row['print_pressure_psi']
-            
-            edge['xy_spacing_mm'] = row['xy_spacing_mm']
-            edge['numpaths_xy'] = int(row['numpaths_xy'])
+    # if view is true a png preview of the toolpath is written next to the gcode file
+    # if analyze is true the program is recorded and its estimated print time, extrusion, travel, swaps and toggles are
+    # printed along with the time spent in each stage of generation, outpath can be None to analyze without writing the gcode
+    # returns a report dict with the stage timings, scheduler stats and, if analyzing, the toolpath summary
+    def generate_network_gcode(self, inpath, outpath, view=False, analyze=False): 
+        timings = {}
+        start = time.perf_counter()
+        node_df, edge_df = load_network(inpath)
+        timings['loading'] = time.perf_counter() - start
 
-            edge['firstlayerheight_mm'] = row['firstlayerheight_mm']
-            edge['z_layerheight_mm'] = row['z_layerheight_mm']
-            edge['numlayers_z'] = int(row['numlayers_z'])
-            
-            all_edges_dict[edge['print_speed_mmps']].append(edge)
+        start = time.perf_counter()
+        edge_df = self.enrich_edges(edge_df)    # generates print parameters 
+        if self.write_back:
+            save_network(inpath, node_df, edge_df)
+        timings['mapping'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        nodes, edges = network_arrays(node_df, edge_df)    # node positions and edge print data as arrays, see networkData
+        del node_df, edge_df
+
+        travel_optimizer = None
+        if self.optimize_travel:
+            home_positions = None if self.material_data is None else [(mat["x_home_position"], mat["y_home_position"]) for mat in self.material_data]
+            travel_optimizer = TravelOptimizer(x0=nodes[edges['node1'], 0], y0=nodes[edges['node1'], 1],
+                                               x1=nodes[edges['node2'], 0], y1=nodes[edges['node2'], 1],
+                                               numpaths_xy=edges['numpaths_xy'], materials=edges['material_index'],
+                                               home_positions=home_positions)
 
         # prints the edges layer by layer, grouped by speed
-        for speed, edges in sorted(all_edges_dict.items(), reverse=True):
-            done = []
-            while len(done) < len(edges):
-                for edge in edges:
-                    if edge in done:
-                        continue
-                    g.print_connection_layer(material_index=edge['material_index'],
-                                            x0=edge['node1_position']['x'], y0=edge['node1_position']['y'], 
-                                            x1=edge['node2_position']['x'], y1=edge['node2_position']['y'], 
-                                            print_speed_mmps=edge['print_speed_mmps'], print_pressure_psi=edge['print_pressure_psi'], 
-                                            numpaths_xy=edge['numpaths_xy'], xy_spacing_mm=edge['xy_spacing_mm'], 
-                                            firstlayerheight_mm=edge['firstlayerheight_mm'], z_layerheight_mm=edge['z_layerheight_mm'], 
-                                            layer_index_z=edge['layer_index_z'])
-                    # marks edge as done if it has been printed on all layers otherwise increments layer index
-                    if edge["layer_index_z"] == edge["numlayers_z"]:
-                        done.append(edge)
-                    else:
-                        edge["layer_index_z"] += 1
+        scheduler = LayerScheduler(print_speeds=edges['print_speed_mmps'], 
+                                   numlayers_z=edges['numlayers_z'],
+                                   materials=edges['material_index'],
+                                   material_batching=self.material_batching,
+                                   travel_optimizer=travel_optimizer)
+        job_edges, layer_index_z, reverse = scheduler.plan_arrays()
+        jobs = edges[job_edges]
+        starts = nodes[np.where(reverse, jobs['node2'], jobs['node1'])]
+        ends = nodes[np.where(reverse, jobs['node1'], jobs['node2'])]
+        timings['scheduling'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        g = gcodeLibrary(outpath, skip_redundant=self.skip_redundant, peephole=self.peephole, backend=self.backend, record=analyze or view, material_data=self.material_data)
+        g.print_connection_layers(material_index=jobs['material_index'],
+                                  x0=starts[:, 0], y0=starts[:, 1], x1=ends[:, 0], y1=ends[:, 1], 
+                                  print_speed_mmps=jobs['print_speed_mmps'], print_pressure_psi=jobs['print_pressure_psi'], 
+                                  numpaths_xy=jobs['numpaths_xy'], xy_spacing_mm=jobs['xy_spacing_mm'], 
+                                  firstlayerheight_mm=jobs['firstlayerheight_mm'], z_layerheight_mm=jobs['z_layerheight_mm'], 
+                                  layer_index_z=layer_index_z, mirror=reverse)    # reversed edges keep their stripe in place
+
+        if 'swaps_before' in scheduler.stats:
+            print(f"Material swaps: {scheduler.stats['swaps_before']} before scheduling, {scheduler.stats['swaps_after']} after")
+        if 'travel_before_mm' in scheduler.stats:
+            print(f"Travel distance: {scheduler.stats['travel_before_mm']:.1f} mm before ordering, {scheduler.stats['travel_after_mm']:.1f} mm after")
             
         g.write_to_file(view)
+        timings['emission'] = time.perf_counter() - start
+
+        report = {'timings': timings, 'scheduler': dict(scheduler.stats)}
+        if analyze:
+            report['toolpath'] = g.toolpath.summary()
+            print_report(report)
+        return report
+
+    # analyzes every network in the input folder without writing any gcode, over a pool of worker processes if workers > 1
+    # returns a dict of input file name to report (see generate_network_gcode), inputs that fail are reported and skipped
+    def analyze_all(self, workers=1):
+        inpaths = find_networks(self.input_folder)
+        reports = {}
+        if workers == 1:
+            for inpath in inpaths:
+                print(f"\nAnalyzing the input file {inpath.name}...")
+                try:
+                    reports[inpath.name] = self.generate_network_gcode(inpath=inpath, outpath=None, analyze=True)
+                except Exception as e:
+                    print(f"Failed to analyze the input file {inpath.name} ({type(e).__name__}: {e}). Skipping...")
+            return reports
 
-    def generate_all(self, view=False):
+        self.load_mappings()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.generate_network_gcode, inpath, None, False, True) for inpath in inpaths]
+            for inpath, future in zip(inpaths, futures):
+                try:
+                    reports[inpath.name] = future.result()
+                except Exception as e:
+                    print(f"Failed to analyze the input file {inpath.name} ({type(e).__name__}: {e}). Skipping...")
+        return reports
+
+    # returns the hash of everything the gcode of a network depends on: the network files, the speed pressure mappings,
+    # the material data, the printer constants, the generator settings, and the generator code itself
+    def cache_key(self, inpath):
+        code_paths = sorted(Path(__file__).parent.glob('*.py')) + sorted((Path(__file__).parent / 'utils').glob('*.py'))
+        settings = {'material_data': self.material_data, 'printer_constants': printer_constants(),
+                    'interpolate_mappings': self.interpolate_mappings, 'optimize_travel': self.optimize_travel,
+                    'material_batching': self.material_batching, 'backend': self.backend,
+                    'skip_redundant': self.skip_redundant, 'peephole': self.peephole}
+        return hash_inputs(network_files(inpath) + list(self.mapping_paths) + code_paths, settings)
+
+    # generates gcode for every network in the input folder (see networkData), over a pool of worker processes if workers > 1 (None uses every CPU)
+    # if view is true a png preview is written next to every program, previews are cached with the programs
+    # networks whose inputs haven't changed since their last build are skipped or copied from the build cache, unless force is true
+    # an input that fails is reported and skipped instead of stopping the batch
+    # returns a dict of input file name to error message for every input that failed
+    def generate_all(self, view=False, workers=1, force=False):
         input_folder = self.input_folder
         output_folder = self.output_folder
 
-        for inpath in sorted(input_folder.glob('*.xlsx')):
-            print(f"\nGenerating network gcode from the input file {inpath.name}...")
-            outpath = output_folder / f"{inpath.stem}_bylayer.pgm"
-            self.generate_network_gcode(inpath=inpath, outpath=outpath, view=view)
-            # try:
-            #     self.generate_network_gcode(inpath=inpath, outpath=outpath, view=view)
-            # except:
-            #     print(f"Failed to generate network gcode from the input file {inpath.name}. Skipping...")
+        jobs = [(inpath, output_folder / f"{network_name(inpath)}_bylayer.pgm") for inpath in find_networks(input_folder)]
+        preview_path = lambda outpath: outpath.with_suffix('.png') if view else None     # where write_to_file puts the preview
+        failures = {}
+        rebuilt = []
+        cached = []
+
+        cache = BuildCache(output_folder, max_bytes=self.cache_max_bytes) if self.use_cache else None
+        keys = {}
+        if cache is not None:
+            keys = {inpath: self.cache_key(inpath) for inpath, _ in jobs}
+            if not force:
+                cached = [inpath.name for inpath, outpath in jobs 
+                          if cache.is_current(keys[inpath], outpath, preview_path(outpath)) or cache.fetch(keys[inpath], outpath, preview_path(outpath))]
+                jobs = [(inpath, outpath) for inpath, outpath in jobs if inpath.name not in cached]
+            for _, outpath in jobs:
+                cache.forget(outpath, outpath.with_suffix('.png'))
+            cache.save()    # saved before rebuilding, so an interrupted run doesn't leave outputs marked as current either
+
+        if workers == 1:
+            for inpath, outpath in jobs:
+                print(f"\nGenerating network gcode from the input file {inpath.name}...")
+                try:
+                    self.generate_network_gcode(inpath=inpath, outpath=outpath, view=view)
+                    rebuilt.append(inpath.name)
+                except Exception as e:
+                    failures[inpath.name] = f"{type(e).__name__}: {e}"
+                    print(f"Failed to generate network gcode from the input file {inpath.name}. Skipping...")
+        elif jobs:
+            self.load_mappings()    # loads the mappings once here so every worker gets a copy instead of rereading them
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self.generate_network_gcode, inpath, outpath, view) for inpath, outpath in jobs]
+                for (inpath, outpath), future in zip(jobs, futures):  # results are collected in input order
+                    try:
+                        future.result()
+                        rebuilt.append(inpath.name)
+                        print(f"Generated network gcode from the input file {inpath.name}")
+                    except Exception as e:
+                        failures[inpath.name] = f"{type(e).__name__}: {e}"
+                        print(f"Failed to generate network gcode from the input file {inpath.name}. Skipping...")
+
+        if cache is not None:
+            for inpath, outpath in jobs:
+                if inpath.name in rebuilt:
+                    cache.store(keys[inpath], outpath, preview_path(outpath))
+            cache.save()
+
+        print(f"\nGenerated {len(rebuilt) + len(cached)} of {len(jobs) + len(cached)} input files")
+        print(f"  rebuilt: {', '.join(rebuilt) if rebuilt else 'none'}")
+        print(f"  served from cache: {', '.join(cached) if cached else 'none'}")
+        for name, error in failures.items():
+            print(f"  {name} failed: {error}")
+        return failures
 
 if __name__ == "__main__":
-    g = NetworkGcodeGenerator()
-    g.generate_all(view=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generates layer by layer gcode for every network in the Input folder.")
+    parser.add_argument('--force', action='store_true', help="regenerate every network, even if its inputs haven't changed")
+    parser.add_argument('--workers', type=int, default=1, help="number of networks to generate in parallel")
+    parser.add_argument('--no-preview', action='store_true', help="don't write a png preview of every generated program")
+    parser.add_argument('--no-skip-redundant', action='store_true', help="write every pressure, dwell and feed command, even ones that repeat the printer's state")
+    parser.add_argument('--no-peephole', action='store_true', help="keep the no-op moves and redundant mode switches in the program")
+    parser.add_argument('--analyze', action='store_true', help="only report the estimated print time, extrusion and travel of every network, without writing gcode")
+    args = parser.parse_args()
+
+    g = NetworkGcodeGenerator(skip_redundant=not args.no_skip_redundant, peephole=not args.no_peephole)
+    if args.analyze:
+        g.analyze_all(workers=args.workers)
+    else:
+        g.generate_all(view=not args.no_preview, workers=args.workers, force=args.force)
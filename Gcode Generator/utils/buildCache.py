@@ -0,0 +1,92 @@
+from pathlib import Path
+import hashlib
+import json
+import shutil
+import time
+
+CACHE_FOLDER_NAME = '.gcode_cache'
+INDEX_NAME = 'index.json'
+
+# returns the sha256 hex digest of a list of files and json serializable settings
+def hash_inputs(paths, settings):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(Path(path).name.encode())
+        with open(path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1 << 20), b''):
+                digest.update(chunk)
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+# content addressed cache of generated gcode programs, stored in a hidden folder inside the output folder
+# programs are stored under the hash of everything that went into them, along with their png preview if one was written,
+# and the least recently used ones are evicted once the cache grows past max_bytes
+class BuildCache:
+    def __init__(self, output_folder, max_bytes=256 * 2**20):
+        self.folder = Path(output_folder) / CACHE_FOLDER_NAME
+        self.max_bytes = max_bytes
+        self.index_path = self.folder / INDEX_NAME
+        self.index = {'entries': {}, 'outputs': {}}  # entries: key -> size and last use, outputs: output name -> key it was built from
+        if self.index_path.exists():
+            with open(self.index_path) as fd:
+                self.index = json.load(fd)
+
+    # returns True if outpath already holds the program for key, and preview_path its preview if given
+    # a hit counts as a use of the cached program
+    def is_current(self, key, outpath, preview_path=None):
+        for path in [outpath] + ([preview_path] if preview_path is not None else []):
+            if not (Path(path).exists() and self.index['outputs'].get(Path(path).name) == key):
+                return False
+        if key in self.index['entries']:
+            self.index['entries'][key]['last_used'] = time.time()
+        return True
+
+    # forgets which program outpath and which preview preview_path hold, called before rebuilding them so a build that fails partway
+    # is never taken as current
+    def forget(self, outpath, preview_path=None):
+        for path in [outpath] + ([preview_path] if preview_path is not None else []):
+            self.index['outputs'].pop(Path(path).name, None)
+
+    # copies the cached program for key to outpath, and its preview to preview_path if given
+    # returns False if the program, or the preview when one is asked for, isn't cached
+    def fetch(self, key, outpath, preview_path=None):
+        copies = [(self.folder / f'{key}.pgm', outpath)]
+        if preview_path is not None:
+            copies.append((self.folder / f'{key}.png', preview_path))
+        if key not in self.index['entries'] or not all(blob.exists() for blob, _ in copies):
+            return False
+        for blob, path in copies:
+            shutil.copyfile(blob, path)
+            self.index['outputs'][Path(path).name] = key
+        self.index['entries'][key]['last_used'] = time.time()
+        return True
+
+    # stores the program at outpath under key, and its preview at preview_path if given, and evicts old programs if the cache is too big
+    def store(self, key, outpath, preview_path=None):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        copies = [(outpath, self.folder / f'{key}.pgm')]
+        if preview_path is not None and Path(preview_path).exists():
+            copies.append((preview_path, self.folder / f'{key}.png'))
+        for path, blob in copies:
+            shutil.copyfile(path, blob)
+            self.index['outputs'][Path(path).name] = key
+        size = sum(blob.stat().st_size for blob in [self.folder / f'{key}.pgm', self.folder / f'{key}.png'] if blob.exists())
+        self.index['entries'][key] = {'size': size, 'last_used': time.time()}
+        self.evict()
+
+    # removes the least recently used programs until the cache fits in max_bytes
+    def evict(self):
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]['size']
+            (self.folder / f'{key}.pgm').unlink(missing_ok=True)
+            (self.folder / f'{key}.png').unlink(missing_ok=True)
+            del entries[key]
+
+    def save(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, 'w') as fd:
+            json.dump(self.index, fd, indent=4)
@@ -1,6 +1,12 @@
 from mecode import G
 from pathlib import Path
 import json
+import os
+import numpy as np
+from utils.gcodeOptimizer import optimize_file
+from utils.gcodeWriter import StreamingG
+from utils.toolpath import ToolpathRecorder
+from utils.toolpathPreview import render_preview
 
 # Printer default constants
 LCE_PRESSURE = 40  # psi
@@ -10,91 +16,168 @@ TRAVEL_HEIGHT = 10 # mm, height above the substrate that the print head will be
 DEFAULT_PRINT_SPEED = 1  # mm/s, this will be changing throughout the process, likely between 4-10 mm/s needed
 DEFAULT_PRINT_HEIGHT = 0.1 # mm, height above the substrate that the print head will be printing on
 
-# data for each material index
-material_data = json.load(open(Path(__file__).parent / 'materialData' / 'material_data.json'))
+# data for each material index, the materialData folder is kept locally and isn't part of the repo
+MATERIAL_DATA_PATH = Path(__file__).parent / 'materialData' / 'material_data.json'
+material_data = json.load(open(MATERIAL_DATA_PATH)) if MATERIAL_DATA_PATH.exists() else None
+
+# returns the printer default constants above by name, used to tell if previously generated gcode is out of date
+def printer_constants():
+    return {name: value for name, value in globals().items() if name.isupper() and isinstance(value, (int, float))}
+
+# decimals every coordinate is written with, by both backends
+OUTPUT_DIGITS = 6
+
+# backends the gcode can be written with: 'mecode' writes every move through mecode, 
+# 'stream' computes each wide line's moves as an array and streams them straight to the file
+BACKENDS = ['mecode', 'stream']
+
+# returns the (2 * numpaths_xy, 2) array of points a wide line meanders through, printing starts at the first point
+# each path runs parallel to the line in alternating directions, stepping spacing_mm along the perpendicular between paths
+# the paths aren't centered on the line, so mirror steps them to the other side instead: a line printed from (x1, y1) to (x0, y0)
+# with mirror covers the same stripe as the line printed from (x0, y0) to (x1, y1) without it
+def meander_waypoints(x0, y0, x1, y1, spacing_mm, numpaths_xy, mirror=False):
+    points, _ = meander_waypoints_batch([x0], [y0], [x1], [y1], [spacing_mm], [numpaths_xy], [mirror])
+    return points
+
+# meander_waypoints for many wide lines at once, the points of line i are points[offsets[i]:offsets[i+1]]
+def meander_waypoints_batch(x0, y0, x1, y1, spacing_mm, numpaths_xy, mirror=None):
+    x0, y0, x1, y1, spacing_mm = (np.asarray(v, dtype=float) for v in (x0, y0, x1, y1, spacing_mm))
+    numpaths_xy = np.asarray(numpaths_xy, dtype=int)
+    side = 1 if mirror is None else np.where(np.asarray(mirror, dtype=bool), -1, 1)
+
+    line_magnitude = ((x1-x0)**2+(y1-y0)**2)**0.5
+    line_unit_vect = np.column_stack([(x1-x0)/line_magnitude, (y1-y0)/line_magnitude])
+    perp_vect = np.column_stack([-line_unit_vect[:, 1], line_unit_vect[:, 0]]) * np.reshape(side, (-1, 1))
+
+    # expands the per line values to one entry per path
+    line = np.repeat(np.arange(len(numpaths_xy)), numpaths_xy)
+    path_offsets = np.concatenate(([0], np.cumsum(numpaths_xy)))
+    paths = np.arange(len(line)) - path_offsets[line]   # index of each path within its line
+
+    offsets = spacing_mm[line]*numpaths_xy[line]/2 - spacing_mm[line]*paths   # perpendicular offset of each path from the line
+    backwards = paths % 2   # every other path runs from the end of the line back to the start
+    base = np.column_stack([x0[line], y0[line]]) + offsets[:, None]*perp_vect[line]
+    path_starts = base + (backwards*line_magnitude[line])[:, None]*line_unit_vect[line]
+    path_ends = base + ((1 - backwards)*line_magnitude[line])[:, None]*line_unit_vect[line]
+
+    points = np.empty((2*len(line), 2))
+    points[0::2] = path_starts
+    points[1::2] = path_ends
+    return clear_negative_zero(points), 2*path_offsets
+
+# returns the coordinates with every value that would be written as -0.000000 set to 0, so it's written as 0.000000
+def clear_negative_zero(values):
+    values = np.asarray(values, dtype=float)
+    return np.where((values <= 0) & (values >= -0.5 * 10.0**-OUTPUT_DIGITS), 0.0, values)
 
 class gcodeLibrary:
-    def __init__(self, outpath=Path(__file__).parent / 'output'):
+    # skip_redundant: skips pressure, dwell and feed commands that repeat the printer's current state
+    # peephole: runs the peephole optimizer over the written program to remove no-op moves and repeated modes/feeds,
+    #           the streaming backend writes the optimized program directly instead of making another pass over the file
+    # material_data: per material settings ordered by material index, defaults to materialData/material_data.json
+    # backend: one of BACKENDS, the streaming backend is much faster on large networks
+    # record: records every move in self.toolpath (see ToolpathRecorder) to analyze or view the program
+    # outpath can be None to only record the program without writing it
+    def __init__(self, outpath=Path(__file__).parent / 'output', skip_redundant=True, peephole=True, material_data=material_data, backend='mecode', record=False):
+        if backend not in BACKENDS:
+            raise Exception(f"ERROR: Backend must be one of {BACKENDS}.")
+        if material_data is None:
+            raise Exception(f"ERROR: No material data given and {MATERIAL_DATA_PATH} doesn't exist.")
         self.outpath = outpath
+        self.backend = backend
+        self.material_data = material_data
         self.material_index = 0
-        global g
-        g = G(outfile=str(self.outpath), aerotech_include=True)
-        g.rename_axis(z='A') # 'A' is our default starting nozzle axis. Will swap if first edge printed is with 'B'
-        g.feed(TRAVEL_SPEED)
+        self.skip_redundant = skip_redundant
+        self.peephole = peephole
+        self.pressures = {}     # last pressure set on each pressure box COM port
+        self.feed_rate = None   # feed rate currently active
+        # each library writes through its own emitter instance
+        outfile = os.devnull if self.outpath is None else str(self.outpath)
+        if backend == 'stream':
+            self.g = StreamingG(outfile=outfile, aerotech_include=True, output_digits=OUTPUT_DIGITS, peephole=peephole)
+        else:
+            self.g = G(outfile=outfile, aerotech_include=True, output_digits=OUTPUT_DIGITS)
+        self.toolpath = None
+        if record:
+            self.toolpath = ToolpathRecorder(self.g, {mat["axis_name"]: i for i, mat in enumerate(self.material_data)})
+            self.g = self.toolpath
+        self.g.rename_axis(z='A') # 'A' is our default starting nozzle axis. Will swap if first edge printed is with 'B'
+        self.__feed(TRAVEL_SPEED)
+
+    def __feed(self, rate):
+        if self.skip_redundant and self.feed_rate == rate:
+            return
+        self.g.feed(rate)
+        self.feed_rate = rate
 
     def __swap_material(self, material_index):
-        g.abs_move(z=TRAVEL_HEIGHT, C=TRAVEL_HEIGHT) # moves z stage of prev material back up before swapping
+        self.g.abs_move(z=TRAVEL_HEIGHT, C=TRAVEL_HEIGHT) # moves z stage of prev material back up before swapping
 
-        prev_mat = material_data[self.material_index]
+        prev_mat = self.material_data[self.material_index]
         self.material_index = material_index
-        mat = material_data[material_index]
-        g.rename_axis(z=mat["axis_name"])
+        mat = self.material_data[material_index]
+        self.g.rename_axis(z=mat["axis_name"])
 
         # sets the new home position for the swapped to nozzle
         dx = mat["x_home_position"] - prev_mat["x_home_position"]
         dy = mat["y_home_position"] - prev_mat["y_home_position"] # each z axis has its own home position so dont need to shift z
 
-        new_x = g.current_position['x'] - dx
-        new_y = g.current_position['y'] - dy
+        new_x = float(clear_negative_zero(self.g.current_position['x'] - dx))
+        new_y = float(clear_negative_zero(self.g.current_position['y'] - dy))
 
-        g.set_home(x=new_x, y=new_y)   # sets current position to new x,y coordinates
+        self.g.set_home(x=new_x, y=new_y)   # sets current position to new x,y coordinates
 
     def __start_printing(self, print_height_mm=0.1, print_speed_mmps=DEFAULT_PRINT_SPEED, print_pressure_psi=LCE_PRESSURE):
         if print_height_mm <= 0:
             raise Exception("ERROR: Print height has to be greater than 0.")
         
-        mat = material_data[self.material_index]
+        mat = self.material_data[self.material_index]
         COM = mat["pressure_COM"]
         dwell = mat["dwell_time"]
-        g.set_pressure(COM, print_pressure_psi)  # set pressure of LCE
-        g.dwell(dwell)
+        # the pressure only needs setting and settling if it changed since the last time this pressure box was used
+        if not self.skip_redundant or self.pressures.get(COM) != print_pressure_psi:
+            self.g.set_pressure(COM, print_pressure_psi)  # set pressure of LCE
+            self.g.dwell(dwell)
+            self.pressures[COM] = print_pressure_psi
 
-        g.abs_move(z=print_height_mm, C=print_height_mm)   # lowers Z stage, assuming 0.1mm layer height
-        g.feed(print_speed_mmps)    # sets print speed
-        g.toggle_pressure(COM)  # turn on the LCE pressure box
+        self.g.abs_move(z=print_height_mm, C=print_height_mm)   # lowers Z stage, assuming 0.1mm layer height
+        self.__feed(print_speed_mmps)    # sets print speed
+        self.g.toggle_pressure(COM)  # turn on the LCE pressure box
 
     def __stop_printing(self):
-        COM = material_data[self.material_index]["pressure_COM"]
-        g.toggle_pressure(COM)  # turn off the core
+        COM = self.material_data[self.material_index]["pressure_COM"]
+        self.g.toggle_pressure(COM)  # turn off the core
 
-        g.feed(TRAVEL_SPEED)
-        g.abs_move(z=TRAVEL_HEIGHT, C=TRAVEL_HEIGHT)
+        self.__feed(TRAVEL_SPEED)
+        self.g.abs_move(z=TRAVEL_HEIGHT, C=TRAVEL_HEIGHT)
 
         if POST_EXTRUSION_DWELL > 0:
-            g.dwell(POST_EXTRUSION_DWELL)
+            self.g.dwell(POST_EXTRUSION_DWELL)
 
     # prints a single straight line from (x0, y0) to (x1, y1)
     def print_single_line(self, x0, y0, x1, y1, print_height_mm=DEFAULT_PRINT_HEIGHT, print_speed_mmps=DEFAULT_PRINT_SPEED, print_pressure_psi=LCE_PRESSURE):
-        g.abs_move(x=x0, y=y0)
+        self.g.abs_move(x=x0, y=y0)
         self.__start_printing(print_height_mm, print_speed_mmps, print_pressure_psi)
-        g.abs_move(x=x1, y=y1)
+        self.g.abs_move(x=x1, y=y1)
         self.__stop_printing()
-        print(g.current_position['x'], g.current_position['y'])
+        print(self.g.current_position['x'], self.g.current_position['y'])
 
     # meanders back and forth to print a wide line
     # x0, y0, x1, y1 are the start and end points of the middle of the line
     # spacing_mm is the distance between each meander and width is the total width of the line
-    def print_wide_line(self, x0, y0, x1, y1, spacing_mm, numpaths_xy, print_height_mm=DEFAULT_PRINT_HEIGHT, print_speed_mmps=DEFAULT_PRINT_SPEED, print_pressure_psi=LCE_PRESSURE):
-        line_unit_vect = ((x1-x0)/((x1-x0)**2+(y1-y0)**2)**0.5, (y1-y0)/((x1-x0)**2+(y1-y0)**2)**0.5)  # unit vector in the direction of the line
-        line_magnitude = ((x1-x0)**2+(y1-y0)**2)**0.5
-        perp_vect = (-line_unit_vect[1], line_unit_vect[0])  # unit vector perpendicular to the line
-        direction = 1
-
-        start_point = {'x': x0 + perp_vect[0]*spacing_mm*numpaths_xy/2, 'y': y0 + perp_vect[1]*spacing_mm*numpaths_xy/2}
-        g.abs_move(x=start_point['x'], y=start_point['y'])
-        self.__start_printing(print_height_mm, print_speed_mmps, print_pressure_psi)
+    # mirror steps the paths to the other side of the line, see meander_waypoints
+    def print_wide_line(self, x0, y0, x1, y1, spacing_mm, numpaths_xy, print_height_mm=DEFAULT_PRINT_HEIGHT, print_speed_mmps=DEFAULT_PRINT_SPEED, print_pressure_psi=LCE_PRESSURE, mirror=False):
+        self.__print_waypoints(meander_waypoints(x0, y0, x1, y1, spacing_mm, numpaths_xy, mirror), print_height_mm, print_speed_mmps, print_pressure_psi)
 
-        # meanders back and forth to print the line
-        for i in range(numpaths_xy):
-            end_point = {'x': start_point['x'] + line_unit_vect[0]*line_magnitude*direction, 'y': start_point['y'] + line_unit_vect[1]*line_magnitude*direction}
-            g.abs_move(x=end_point['x'], y=end_point['y']) # moves parallel to line
-
-            if i == numpaths_xy-1: break # if it's the last meander, it doesn't need to move perpendicularly
-            start_point = {'x': end_point['x'] - perp_vect[0]*spacing_mm, 'y': end_point['y'] - perp_vect[1]*spacing_mm} # moves perpendicularly to start of next line
-            g.abs_move(x=start_point['x'], y=start_point['y'])
-
-            direction *= -1 # switches line direction to go back the other way
-        
+    # prints through an (n, 2) array of points, travelling to the first one and printing the rest
+    def __print_waypoints(self, points, print_height_mm, print_speed_mmps, print_pressure_psi):
+        self.g.abs_move(x=float(points[0, 0]), y=float(points[0, 1]))
+        self.__start_printing(print_height_mm, print_speed_mmps, print_pressure_psi)
+        if self.backend == 'stream':
+            self.g.abs_moves(points[1:])
+        else:
+            for x, y in points[1:].tolist():
+                self.g.abs_move(x=x, y=y)
         self.__stop_printing()
 
     # prints a connection with all input parameters, intended for Liwei output format
@@ -113,7 +196,8 @@ class gcodeLibrary:
 
     # prints a single layer of a connection
     # layer index z is 1 indexed (first layer has index 1, etc)
-    def print_connection_layer(self, material_index, x0, y0, x1, y1, print_speed_mmps, print_pressure_psi, layer_index_z, numpaths_xy, xy_spacing_mm, firstlayerheight_mm, z_layerheight_mm):
+    # mirror is true for a connection printed from its second node to its first, so it covers the same stripe (see meander_waypoints)
+    def print_connection_layer(self, material_index, x0, y0, x1, y1, print_speed_mmps, print_pressure_psi, layer_index_z, numpaths_xy, xy_spacing_mm, firstlayerheight_mm, z_layerheight_mm, mirror=False):
         if not (layer_index_z > 0 and numpaths_xy > 0 and xy_spacing_mm > 0 and z_layerheight_mm > 0 and print_speed_mmps > 0 and print_pressure_psi > 0):
             raise Exception(f"ERROR: Number of paths, spacing, speed, pressure, layer index, and layer height must be greater than 0.")
 
@@ -123,13 +207,114 @@ class gcodeLibrary:
 
         print_height_mm = z_layerheight_mm * (layer_index_z - 1) + firstlayerheight_mm
         self.print_wide_line(x0, y0, x1, y1, spacing_mm=xy_spacing_mm, numpaths_xy=numpaths_xy, 
-                                print_height_mm=print_height_mm, print_speed_mmps=print_speed_mmps, print_pressure_psi=print_pressure_psi)
+                                print_height_mm=print_height_mm, print_speed_mmps=print_speed_mmps, print_pressure_psi=print_pressure_psi, mirror=mirror)
 
-    def write_to_file(self, view=False):
-        # only works with matplotlib version 3.5.1
+    # prints many connection layers in order, every argument is an array with one entry per connection layer
+    # the meanders of all of them are computed at once, and with the streaming backend they're written as one batch
+    def print_connection_layers(self, material_index, x0, y0, x1, y1, print_speed_mmps, print_pressure_psi, layer_index_z, numpaths_xy, xy_spacing_mm, firstlayerheight_mm, z_layerheight_mm, mirror=None):
+        mirror = np.zeros(len(material_index), dtype=bool) if mirror is None else np.asarray(mirror, dtype=bool)
+        material_index, layer_index_z, numpaths_xy = (np.asarray(v, dtype=int) for v in (material_index, layer_index_z, numpaths_xy))
+        xy_spacing_mm, firstlayerheight_mm, z_layerheight_mm = (np.asarray(v, dtype=float) for v in (xy_spacing_mm, firstlayerheight_mm, z_layerheight_mm))
+        print_speed_mmps, print_pressure_psi = np.asarray(print_speed_mmps), np.asarray(print_pressure_psi)   # kept as given, they're written as is
+        if not np.all((layer_index_z > 0) & (numpaths_xy > 0) & (xy_spacing_mm > 0) & (z_layerheight_mm > 0) & (print_speed_mmps > 0) & (print_pressure_psi > 0)):
+            raise Exception(f"ERROR: Number of paths, spacing, speed, pressure, layer index, and layer height must be greater than 0.")
+
+        print_height_mm = z_layerheight_mm * (layer_index_z - 1) + firstlayerheight_mm
+        points, offsets = meander_waypoints_batch(x0, y0, x1, y1, xy_spacing_mm, numpaths_xy, mirror)
+
+        if self.backend == 'stream' and self.toolpath is None:
+            self.__print_layers_batched(material_index, points, offsets, print_height_mm, print_speed_mmps, print_pressure_psi)
+            return
+
+        # the loop below runs once per connection layer, so it works on python scalars instead of numpy ones
+        material_index, print_height_mm, offsets = material_index.tolist(), print_height_mm.tolist(), offsets.tolist()
+        print_speed_mmps, print_pressure_psi = print_speed_mmps.tolist(), print_pressure_psi.tolist()
+        for i in range(len(material_index)):
+            # checks material index and swaps if necessary
+            if self.material_index != material_index[i]:
+                self.__swap_material(material_index[i])
+            self.__print_waypoints(points[offsets[i]:offsets[i + 1]], print_height_mm[i], print_speed_mmps[i], print_pressure_psi[i])
+
+    # print_connection_layers for the streaming backend when nothing is recorded
+    # __swap_material, __start_printing and __stop_printing decide the swaps, pressures and feeds of every connection layer
+    # at once here, and the layers are written as one StreamingG batch instead of command by command
+    def __print_layers_batched(self, material_index, points, offsets, print_height_mm, print_speed_mmps, print_pressure_psi):
+        n = len(material_index)
+        if n == 0:
+            return
+        if np.any(print_height_mm <= 0):
+            raise Exception("ERROR: Print height has to be greater than 0.")
+        starts, ends = offsets[:-1], offsets[1:]
+        homes = np.array([(mat["x_home_position"], mat["y_home_position"]) for mat in self.material_data], dtype=float)
+        axes = np.array([mat["axis_name"] for mat in self.material_data], dtype=object)
+        coms = np.array([mat["pressure_COM"] for mat in self.material_data])[material_index]
+        dwells = np.array([mat["dwell_time"] for mat in self.material_data])[material_index]
+
+        # a swap sets the home of the new nozzle from where the layer before left the nozzle
+        previous = np.concatenate(([self.material_index], material_index[:-1]))
+        swap = material_index != previous
+        position = np.vstack([[self.g.current_position['x'], self.g.current_position['y']], points[ends[:-1] - 1]])
+        home = clear_negative_zero(position - (homes[material_index] - homes[previous]))
+
+        # the pressure is only set when it changed since the last layer on the same pressure box
+        pressure_set = np.ones(n, dtype=bool)
+        if self.skip_redundant:
+            for com in np.unique(coms).tolist():
+                layers = np.flatnonzero(coms == com)
+                pressures = print_pressure_psi[layers]
+                pressure_set[layers[1:]] = pressures[1:] != pressures[:-1]
+                if com in self.pressures:
+                    pressure_set[layers[0]] = self.pressures[com] != pressures[0]
+        # the feed is only set when it changes, every layer ends at the travel speed
+        feed_before = np.concatenate(([np.nan if self.feed_rate is None else self.feed_rate], np.full(n - 1, TRAVEL_SPEED)))
+        print_feed = (feed_before != print_speed_mmps) | (not self.skip_redundant)
+        travel_feed = (print_speed_mmps != TRAVEL_SPEED) | (not self.skip_redundant)
+
+        batch = self.g.batch(n)
+        # __swap_material
+        batch.abs_move(z=TRAVEL_HEIGHT, C=TRAVEL_HEIGHT, where=swap)
+        batch.rename_axis(z=axes[material_index], where=swap)
+        batch.set_home(x=home[:, 0], y=home[:, 1], where=swap)
+        # __print_waypoints, with __start_printing and __stop_printing
+        batch.abs_move(x=points[starts, 0], y=points[starts, 1])
+        batch.set_pressure(coms, print_pressure_psi, where=pressure_set)
+        batch.dwell(dwells, where=pressure_set)
+        batch.abs_move(z=print_height_mm, C=print_height_mm)
+        batch.feed(print_speed_mmps, where=print_feed)
+        batch.toggle_pressure(coms)
+        batch.abs_moves(np.delete(points, starts, axis=0), offsets - np.arange(n + 1))
+        batch.toggle_pressure(coms)
+        batch.feed(TRAVEL_SPEED, where=travel_feed)
+        batch.abs_move(z=TRAVEL_HEIGHT, C=TRAVEL_HEIGHT)
+        if POST_EXTRUSION_DWELL > 0:
+            batch.dwell(POST_EXTRUSION_DWELL)
+        batch.write()
+
+        self.material_index = int(material_index[-1])
+        self.feed_rate = TRAVEL_SPEED
+        self.pressures.update(zip(coms.tolist(), print_pressure_psi.tolist()))     # the last layer on each pressure box sets its pressure
+
+    # view renders a png preview of the recorded toolpath (see toolpathPreview) to preview_path, next to the gcode file by default
+    # viewing needs the library to have been created with record=True
+    def write_to_file(self, view=False, preview_path=None):
         if view:
-            g.view(backend='matplotlib')
-        g.teardown()
+            if self.toolpath is None:
+                raise Exception("ERROR: The toolpath must be recorded to view it, create the library with record=True.")
+            if preview_path is None and self.outpath is None:
+                raise Exception("ERROR: A preview path must be given to view a program that isn't written to a file.")
+            preview_path = Path(self.outpath).with_suffix('.png') if preview_path is None else preview_path
+            render_preview(self.toolpath.moves(), preview_path, title=Path(preview_path).stem)
+            print(f'Toolpath preview written to {preview_path}')
+
+        self.g.teardown()
+        if not self.g.out_fd.closed:
+            self.g.out_fd.close()    # mecode only closes files it didn't open itself
+        if self.outpath is None:
+            return
+
+        if self.peephole:
+            removed = self.g.removed_lines if self.backend == 'stream' else optimize_file(self.outpath)
+            print(f'Peephole optimizer removed {removed} redundant lines')
         print(f'Gcode file written to {self.outpath}')
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+import os
+import re
+
+# matches the mecode motion lines (G0-G3) and set home lines (G92), capturing the axis words
+MOVE_LINE = re.compile(r'^(G0|G1|G2|G3|G92) ((?:[A-Z]-?[0-9.]+ ?)+)(;.*)?$')
+AXIS_WORD = re.compile(r'([A-Z])(-?[0-9.]+)')
+ABSOLUTE_LINE = re.compile(r'^G90\b')
+RELATIVE_LINE = re.compile(r'^G91\b')
+
+# peephole optimizer over an emitted program, only removes lines that provably don't change what the printer does
+#   - moves to the position the axes are already at
+#   - feed commands that set the feed rate that is already active
+#   - switches to relative mode that are undone by a switch back to absolute before any move
+#   - switches to the positioning mode that is already active
+# lines in the aerotech header/footer functions are indented, so they are never matched and kept as is
+# every step is a generator, so lines are streamed through all of them in a single pass without holding the program in memory
+def peephole_optimize(lines):
+    lines = _remove_noop_moves(lines)
+    lines = _remove_unused_relative_mode(lines)
+    lines = _remove_repeated_modes(lines)
+    return lines
+
+# optimizes a program file in place through a temporary file next to it, returns the number of lines removed
+def optimize_file(path):
+    counts = {'in': 0, 'out': 0}
+    def read(fd):
+        for line in fd:
+            counts['in'] += 1
+            yield line.rstrip('\r\n')
+
+    temp_path = f"{path}.tmp"
+    with open(path) as in_fd, open(temp_path, 'w') as out_fd:
+        for line in peephole_optimize(read(in_fd)):
+            counts['out'] += 1
+            out_fd.write(line + '\n')
+    os.replace(temp_path, path)
+    return counts['in'] - counts['out']
+
+def _parse_move(line):
+    match = MOVE_LINE.match(line)
+    if match is None:
+        return None, None
+    return match.group(1), {axis: value for axis, value in AXIS_WORD.findall(match.group(2))}
+
+def _remove_noop_moves(lines):
+    position = {}   # last commanded absolute position of each axis, as written in the program
+    feed = None
+    absolute = None
+    for line in lines:
+        if ABSOLUTE_LINE.match(line):
+            absolute = True
+        elif RELATIVE_LINE.match(line):
+            absolute = False
+
+        command, words = _parse_move(line)
+        if command is None:
+            yield line
+            continue
+
+        if command == 'G92':
+            position.update(words)
+            yield line
+            continue
+
+        rate = words.pop('F', None)
+        if rate is not None and not words:
+            # feed only line
+            if feed is not None and float(rate) == float(feed):
+                continue
+            feed = rate
+            yield line
+            continue
+        if rate is not None:
+            feed = rate
+
+        if absolute is True and rate is None and command in ('G0', 'G1') and all(position.get(axis) == value for axis, value in words.items()):
+            continue
+        if absolute is False and rate is None and command in ('G0', 'G1') and all(float(value) == 0 for value in words.values()):
+            continue
+
+        if absolute is True:
+            position.update(words)
+        else:
+            for axis in words:
+                position.pop(axis, None)  # relative or unknown mode moves leave the axis position unknown here
+        yield line
+
+# drops G91 lines that are followed by a G90 line before any move or set home
+# a G91 line is held back with the lines after it until the next G90 or move decides whether it is needed
+def _remove_unused_relative_mode(lines):
+    pending = []    # the undecided G91 line and the lines after it
+    for line in lines:
+        if RELATIVE_LINE.match(line):
+            yield from pending  # a G91 followed by another one is kept
+            pending = [line]
+        elif ABSOLUTE_LINE.match(line):
+            yield from pending[1:]
+            pending = []
+            yield line
+        elif pending and MOVE_LINE.match(line) and not _is_feed_line(line):
+            yield from pending
+            pending = []
+            yield line
+        elif pending:
+            pending.append(line)
+        else:
+            yield line
+    yield from pending
+
+# drops G90/G91 lines that switch to the mode that is already active
+def _remove_repeated_modes(lines):
+    absolute = None
+    for line in lines:
+        if ABSOLUTE_LINE.match(line):
+            if absolute is True:
+                continue
+            absolute = True
+        elif RELATIVE_LINE.match(line):
+            if absolute is False:
+                continue
+            absolute = False
+        yield line
+
+def _is_feed_line(line):
+    command, words = _parse_move(line)
+    return command == 'G1' and list(words) == ['F']
@@ -0,0 +1,552 @@
+from collections import defaultdict
+from pathlib import Path
+import numpy as np
+import mecode
+
+# folder with the aerotech header and footer that mecode includes, reused so both backends write the same program
+MECODE_FOLDER = Path(mecode.__file__).parent
+
+# lines written for each command, the same as mecode's, %s placeholders are filled with the values as given
+ABSOLUTE_LINE = 'G90 ;absolute\n'
+RELATIVE_LINE = 'G91 ;relative\n'
+FEED_LINE = 'G1 F%s\n'
+DWELL_LINE = 'G4 P%s\n'
+SET_PRESSURE_LINE = 'Call setPress P%s Q%s\n'
+TOGGLE_PRESSURE_LINE = 'Call togglePress P%s\n'
+
+# streams aerotech gcode straight to a file without mecode's per move bookkeeping
+# implements the subset of the mecode G interface that gcodeLibrary uses and writes the same lines mecode would,
+# plus abs_moves to write a whole array of xy moves at once, and batch to write the same commands for many rows at once
+# lines are buffered as %-format templates plus their values, and formatted and written to the file in one go every buffer_size lines
+# with peephole true it writes the program gcodeOptimizer.peephole_optimize would turn mecode's into, so the file doesn't need the extra pass:
+# no-op moves and repeated feeds are skipped, and the G90/G91 pair mecode writes around every move is only written where the mode changes
+class StreamingG:
+    def __init__(self, outfile, aerotech_include=True, output_digits=6, buffer_size=100000, peephole=False):
+        self.outfile = outfile
+        self.aerotech_include = aerotech_include
+        self.output_digits = output_digits
+        self.buffer_size = buffer_size
+        self.peephole = peephole
+        self.removed_lines = 0  # lines of mecode's program that peephole left out
+        self.x_axis, self.y_axis, self.z_axis = 'X', 'Y', 'Z'
+        self.is_relative = True
+        self.speed = 0
+        self._current_position = defaultdict(float)
+
+        self.out_fd = open(outfile, 'w')
+        self._buffer = []      # line templates
+        self._values = []      # values to fill into the templates
+        self._templates = {}
+
+        # peephole state, mirroring the passes of gcodeOptimizer
+        self._written_position = {}     # axis name -> last absolute position as written
+        self._written_feed = None
+        self._written_mode = None       # 'G90' or 'G91', the positioning mode last written
+        self._pending_relative = None   # index in the buffer of a G91 that is only written if a move or set home needs it
+
+        if self.aerotech_include:
+            self._write_file(MECODE_FOLDER / 'header.txt')
+        self._relative_mode()
+
+    @property
+    def current_position(self):
+        return self._current_position
+
+    def write(self, line):
+        self._buffer.append(line.replace('%', '%%') + '\n')
+        if len(self._buffer) >= self.buffer_size and self._pending_relative is None:
+            self.flush()
+
+    def flush(self):
+        self.out_fd.write(''.join(self._buffer) % tuple(self._values))
+        self._buffer = []
+        self._values = []
+
+    def _write_template(self, template, values):
+        self._buffer.append(template)
+        self._values += values
+        if len(self._buffer) >= self.buffer_size and self._pending_relative is None:
+            self.flush()
+
+    def _relative_mode(self):
+        if not self.peephole:
+            self._write_template(RELATIVE_LINE, [])
+            return
+        self._keep_relative()   # a G91 followed by another one is kept
+        self._buffer.append('')
+        self._pending_relative = len(self._buffer) - 1
+
+    def _absolute_mode(self):
+        if not self.peephole:
+            self._write_template(ABSOLUTE_LINE, [])
+            return
+        if self._pending_relative is not None:
+            self._pending_relative = None   # undone before any move, so it stays out
+            self.removed_lines += 1
+        if self._written_mode == 'G90':
+            self.removed_lines += 1
+        else:
+            self._write_template(ABSOLUTE_LINE, [])
+            self._written_mode = 'G90'
+
+    # writes the pending G91 where it was issued, called once a move or set home needs it
+    def _keep_relative(self):
+        if self._pending_relative is None:
+            return
+        if self._written_mode == 'G91':
+            self.removed_lines += 1
+        else:
+            self._buffer[self._pending_relative] = RELATIVE_LINE
+            self._written_mode = 'G91'
+        self._pending_relative = None
+
+    def rename_axis(self, x=None, y=None, z=None):
+        if x is not None:
+            self.x_axis = x
+        elif y is not None:
+            self.y_axis = y
+        elif z is not None:
+            self.z_axis = z
+        else:
+            raise RuntimeError('Must specify new name for x, y, or z only')
+
+    def set_home(self, x=None, y=None, z=None, **kwargs):
+        args = self._format_args(x, y, z, **kwargs)
+        if self.peephole and args:
+            self._keep_relative()
+            self._written_position.update(self._format_words(x, y, z, **kwargs))
+        self.write('G92' + (' ' if args else '') + args + ' ;set home')
+        self._update_position(x, y, z, **kwargs)
+
+    def feed(self, rate):
+        self.speed = rate
+        if self.peephole:
+            if self._written_feed is not None and float(rate) == float(self._written_feed):
+                self.removed_lines += 1
+                return
+            self._written_feed = rate
+        self._write_template(FEED_LINE, [rate])
+
+    def dwell(self, time):
+        self._write_template(DWELL_LINE, [time])
+
+    def set_pressure(self, com_port, value):
+        self._write_template(SET_PRESSURE_LINE, [com_port, value])
+
+    def toggle_pressure(self, com_port):
+        self._write_template(TOGGLE_PRESSURE_LINE, [com_port])
+
+    def abs_move(self, x=None, y=None, z=None, **kwargs):
+        names = []
+        values = []
+        if x is not None:
+            names.append(self.x_axis)
+            values.append(x)
+        if y is not None:
+            names.append(self.y_axis)
+            values.append(y)
+        if z is not None:
+            names.append(self.z_axis)
+            values.append(z)
+        for name in sorted(kwargs):
+            names.append(name)
+            values.append(kwargs[name])
+        if self.peephole:
+            self._peephole_move(names, values)
+        else:
+            self._write_template(self._move_template(tuple(names)), values)
+        self._update_position(x, y, z, **kwargs)
+
+    # writes a single absolute move, unless it goes to where the axes already are
+    def _peephole_move(self, names, values):
+        words = dict(zip(names, (f'{value:.{self.output_digits}f}' for value in values)))
+        if self.is_relative:
+            self._absolute_mode()
+        if words and all(self._written_position.get(name) == word for name, word in words.items()):
+            self.removed_lines += 1
+        else:
+            self._keep_relative()
+            self._write_template(self._move_template(tuple(names)), values)
+            self._written_position.update(words)
+        if self.is_relative:
+            self._relative_mode()
+
+    # writes an absolute xy move to every row of an (n, 2) array of points
+    def abs_moves(self, points):
+        if len(points) == 0:
+            return
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self._current_position['x'], self._current_position['y'] = float(points[-1, 0]), float(points[-1, 1])
+        if self.peephole:
+            self._peephole_moves(points)
+            return
+        values = points.ravel().tolist()
+        self._write_template(self._move_template((self.x_axis, self.y_axis)) * len(points), values)
+
+    # abs_moves with peephole, the whole array is written in absolute mode and points written the same as the one before are left out
+    def _peephole_moves(self, points):
+        d = self.output_digits
+        names = (self.x_axis, self.y_axis)
+        noop = np.zeros(len(points), dtype=bool)
+        noop[0] = all(self._written_position.get(name) == f'{value:.{d}f}' for name, value in zip(names, points[0]))
+        # only points within rounding of the one before can be written the same, those are checked exactly
+        for i in np.flatnonzero(np.all(np.abs(np.diff(points, axis=0)) < 10.0**-d, axis=1)) + 1:
+            noop[i] = all(f'{a:.{d}f}' == f'{b:.{d}f}' for a, b in zip(points[i], points[i - 1]))
+        points = points[~noop]
+        self.removed_lines += int(noop.sum()) + (2 * (len(noop) - 1) if self.is_relative else 0)    # and the modes around every move after the first
+
+        if self.is_relative:
+            self._absolute_mode()
+        if len(points) > 0:
+            self._keep_relative()
+            self._write_template(self._move_template(names) * len(points), points.ravel().tolist())
+            self._written_position.update(zip(names, (f'{value:.{d}f}' for value in points[-1])))
+        if self.is_relative:
+            self._relative_mode()
+
+    # returns a StreamingBatch to write the same commands for many rows at once
+    def batch(self, rows):
+        return StreamingBatch(self, rows)
+
+    # returns the lines of an absolute move of the named axes, with a %f placeholder for each axis
+    # matches mecode, which switches to absolute mode around the move when in relative mode, with peephole the modes are written separately
+    def _move_template(self, names):
+        key = (names, self.is_relative and not self.peephole)
+        if key not in self._templates:
+            move = 'G1 ' + ' '.join(f'{name}%.{self.output_digits}f' for name in names) + '\n'
+            self._templates[key] = ABSOLUTE_LINE + move + RELATIVE_LINE if key[1] else move
+        return self._templates[key]
+
+    # returns the line of a set home of the named axes, with a %f placeholder for each axis
+    def _home_template(self, names):
+        return 'G92 ' + ' '.join(f'{name}%.{self.output_digits}f' for name in names) + ' ;set home\n'
+
+    def view(self, backend='matplotlib'):
+        raise Exception("ERROR: The streaming backend doesn't keep a move history to view.")
+
+    def teardown(self):
+        self._keep_relative()
+        if self.aerotech_include:
+            self._write_file(MECODE_FOLDER / 'footer.txt')
+        self.flush()
+        self.out_fd.close()
+
+    # mecode writes the last line of an included file twice, which is kept so both backends write the same program
+    def _write_file(self, path):
+        with open(path) as fd:
+            lines = fd.readlines()
+        for line in lines + lines[-1:]:
+            self.write(line.rstrip())
+
+    # same argument formatting as mecode, renamed axes take the name of the axis and extra axes are sorted by name
+    def _format_args(self, x=None, y=None, z=None, **kwargs):
+        d = self.output_digits
+        args = []
+        if x is not None:
+            args.append(f'{self.x_axis}{x:.{d}f}')
+        if y is not None:
+            args.append(f'{self.y_axis}{y:.{d}f}')
+        if z is not None:
+            args.append(f'{self.z_axis}{z:.{d}f}')
+        args += [f'{axis}{kwargs[axis]:.{d}f}' for axis in sorted(kwargs)]
+        return ' '.join(args)
+
+    # the axis words of a move as written, keyed by axis name
+    def _format_words(self, x=None, y=None, z=None, **kwargs):
+        d = self.output_digits
+        words = {}
+        for name, value in [(self.x_axis, x), (self.y_axis, y), (self.z_axis, z)] + sorted(kwargs.items()):
+            if value is not None:
+                words[name] = f'{value:.{d}f}'
+        return words
+
+    # same as mecode, renamed axes are tracked under both names
+    def _update_position(self, x=None, y=None, z=None, **kwargs):
+        if x is not None:
+            self._current_position['x'] = x
+            if self.x_axis != 'X':
+                self._current_position[self.x_axis] = x
+        if y is not None:
+            self._current_position['y'] = y
+            if self.y_axis != 'Y':
+                self._current_position[self.y_axis] = y
+        if z is not None:
+            self._current_position['z'] = z
+            if self.z_axis != 'Z':
+                self._current_position[self.z_axis] = z
+        self._current_position.update(kwargs)
+
+# writes the same sequence of commands for many rows at once (e.g. every connection layer of a network), see StreamingG.batch
+# every command is given once for all rows, with an array of one value per row (or a single value for all of them) and an optional
+# mask of the rows it is in. write() writes the rows one after another, with the commands of each in the order they were given
+# the program is the same as calling the StreamingG commands row by row, including everything peephole leaves out,
+# but the no-op moves, repeated feeds and mode switches are found with array operations over all rows instead of line by line
+# only the z axis can be renamed within a batch
+class StreamingBatch:
+    def __init__(self, g, rows):
+        self.g = g
+        self.rows = rows
+        self._commands = []     # (kind, arguments, mask of the rows it is in) in the order given
+
+    def rename_axis(self, z, where=None):
+        self._add('rename', self._column(z).astype(object), where)
+
+    def set_home(self, x=None, y=None, z=None, where=None, **kwargs):
+        self._add('home', self._axes(x, y, z, kwargs), where)
+
+    def feed(self, rate, where=None):
+        self._add('feed', self._column(rate), where)
+
+    def dwell(self, time, where=None):
+        self._add('line', (DWELL_LINE, [self._column(time)]), where)
+
+    def set_pressure(self, com_port, value, where=None):
+        self._add('line', (SET_PRESSURE_LINE, [self._column(com_port), self._column(value)]), where)
+
+    def toggle_pressure(self, com_port, where=None):
+        self._add('line', (TOGGLE_PRESSURE_LINE, [self._column(com_port)]), where)
+
+    def abs_move(self, x=None, y=None, z=None, where=None, **kwargs):
+        self._add('move', self._axes(x, y, z, kwargs), where)
+
+    # moves row i through the points[offsets[i]:offsets[i + 1]] of an (n, 2) array of points like StreamingG.abs_moves
+    def abs_moves(self, points, offsets):
+        offsets = np.asarray(offsets, dtype=int)
+        self._add('moves', (np.asarray(points, dtype=float).reshape(-1, 2), offsets), offsets[1:] > offsets[:-1])
+
+    def _add(self, kind, arguments, where):
+        rows = np.ones(self.rows, dtype=bool) if where is None else np.broadcast_to(np.asarray(where, dtype=bool), (self.rows,))
+        self._commands.append((kind, arguments, rows))
+
+    def _column(self, values):
+        return np.broadcast_to(np.asarray(values), (self.rows,))
+
+    # the axes of a move or set home in the order mecode writes them, as (axis, values) with the x, y and z axes by their default name
+    def _axes(self, x, y, z, kwargs):
+        axes = [(axis, value) for axis, value in [('x', x), ('y', y), ('z', z)] + sorted(kwargs.items()) if value is not None]
+        return [(axis, self._column(value).astype(float)) for axis, value in axes]
+
+    # writes every row, and leaves the writer in the state the row by row commands would have left it in
+    def write(self):
+        g = self.g
+        n = len(self._commands)
+        if self.rows == 0 or n == 0:
+            return
+        d = g.output_digits
+        modes = g.peephole and g.is_relative    # moves are written with a mode switch around them that peephole leaves out where it can
+        # every line is ordered by (row, command, point), with key = (row * n + command) * span + point
+        span = max([1] + [int(np.diff(arguments[1]).max(initial=0)) for kind, arguments, _ in self._commands if kind == 'moves'])
+        def keys(k, rows, points=0):
+            return (rows * n + k) * span + points
+
+        # axis names are numbered in the order they're first used, z_codes gives the z axis of each row of a command after the renames before it
+        names = [g.x_axis, g.y_axis, g.z_axis]
+        def code(name):
+            if name not in names:
+                names.append(name)
+            return names.index(name)
+        def codes(new_names):
+            unique_names, inverse = np.unique(new_names.astype(str), return_inverse=True)
+            return np.array([code(name) for name in unique_names.tolist()], dtype=int)[inverse.ravel()]
+        renames = [(keys(k, np.flatnonzero(rows)), codes(new_names[rows])) for k, (kind, new_names, rows) in enumerate(self._commands) if kind == 'rename']
+        rename_keys = np.concatenate([np.empty(0, dtype=int)] + [key for key, _ in renames])
+        rename_codes = np.concatenate([np.empty(0, dtype=int)] + [codes for _, codes in renames])
+        order = np.argsort(rename_keys, kind='stable')
+        rename_keys, rename_codes = rename_keys[order], rename_codes[order]
+        def z_codes(k, rows):
+            latest = np.searchsorted(rename_keys, keys(k, rows)) - 1
+            codes = np.full(len(rows), code(g.z_axis))
+            codes[latest >= 0] = rename_codes[latest[latest >= 0]]
+            return codes
+        def axis_codes(k, rows, arguments):
+            return [z_codes(k, rows) if axis == 'z' else np.full(len(rows), code({'x': g.x_axis, 'y': g.y_axis}.get(axis, axis))) for axis, _ in arguments]
+
+        # every axis position written, in columns of: key, axis, whether it's given as z, value, and the move it's in (-1 for a set home)
+        positions = [[], [], [], [], []]
+        homes_and_moves = [[], []]      # keys of the set homes and moves, and whether each is a set home, they decide the mode switches
+        moves = {}      # command -> index of its first move, and for abs_moves the points of its rows
+        count = 0
+        for k, (kind, arguments, rows) in enumerate(self._commands):
+            rows = np.flatnonzero(rows)
+            if kind in ('move', 'home') and arguments:
+                move = count + np.arange(len(rows)) if kind == 'move' else np.full(len(rows), -1)
+                for (axis, values), codes in zip(arguments, axis_codes(k, rows, arguments)):
+                    for column, data in zip(positions, (keys(k, rows), codes, np.full(len(rows), axis == 'z'), values[rows], move)):
+                        column.append(data)
+                if kind == 'move':
+                    moves[k] = count
+                    count += len(rows)
+                if kind == 'home' or modes:
+                    homes_and_moves[0].append(keys(k, rows))
+                    homes_and_moves[1].append(np.full(len(rows), kind == 'home'))
+            elif kind == 'moves':
+                points, offsets = arguments
+                lengths = offsets[rows + 1] - offsets[rows]
+                point_rows = np.repeat(rows, lengths)
+                within = np.arange(len(point_rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)     # index of each point in its row
+                index = offsets[point_rows] + within
+                for axis in (0, 1):
+                    for column, data in zip(positions, (keys(k, point_rows, within), np.full(len(index), axis), np.zeros(len(index), dtype=bool),
+                                                        points[index, axis], count + np.arange(len(index)))):
+                        column.append(data)
+                moves[k] = (count, index, lengths)
+                count += len(index)
+                if modes:
+                    homes_and_moves[0].append(keys(k, rows))
+                    homes_and_moves[1].append(np.zeros(len(rows), dtype=bool))
+        key, axis, is_z, value, move = (np.concatenate(column) if column else np.empty(0, dtype=int) for column in positions)
+        order = np.argsort(axis * (key.max(initial=0) + 1) + key)     # by axis, then in the order written
+        key, axis, is_z, value, move = key[order], axis[order], is_z[order].astype(bool), value[order].astype(float), move[order]
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = axis[1:] != axis[:-1]
+        last = np.roll(first, -1)
+        removed = 0
+
+        # with peephole a move is left out if every axis it moves is written the same as the last position written for that axis
+        noop = np.zeros(count, dtype=bool)
+        if g.peephole:
+            same = np.zeros(len(key), dtype=bool)
+            previous = np.roll(value, 1)
+            for i in np.flatnonzero(~first & (np.abs(value - previous) < 10.0**-d)).tolist():
+                same[i] = f'{value[i]:.{d}f}' == f'{previous[i]:.{d}f}'
+            for i in np.flatnonzero(first).tolist():
+                same[i] = g._written_position.get(names[axis[i]]) == f'{value[i]:.{d}f}'
+            noop = np.bincount(move[~same & (move >= 0)], minlength=count) == 0
+            removed += int(noop.sum())
+            g._written_position.update((names[axis[i]], f'{value[i]:.{d}f}') for i in np.flatnonzero(last).tolist())
+
+        # with peephole mecode's G90 before and G91 after every move are only written where they change the mode:
+        # a G91 is written if a set home comes before the next move, and a G90 if the mode isn't already absolute
+        keep_pending = None     # whether the G91 pending before the batch is written, once the batch decides it
+        ends_pending = g._pending_relative is not None
+        if homes_and_moves[0]:
+            mode_key, home = np.concatenate(homes_and_moves[0]), np.concatenate(homes_and_moves[1])
+            order = np.argsort(mode_key, kind='stable')
+            mode_key, home = mode_key[order], home[order]
+            pending = np.concatenate(([g._pending_relative is not None], ~home[:-1]))   # a move leaves a pending G91
+            # the mode after each of them: absolute after a move, relative after a set home that writes the pending G91, unchanged otherwise
+            start_mode = {'G90': 1, 'G91': 2}.get(g._written_mode, 0)
+            latest = np.maximum.accumulate(np.where(~home | pending, np.arange(len(home)), -1))
+            mode_after = np.where(latest >= 0, np.where(home, 2, 1)[np.maximum(latest, 0)], start_mode)
+            mode_before = np.concatenate(([start_mode], mode_after[:-1]))
+
+            absolute = ~home & (mode_before != 1)
+            removed += int(np.count_nonzero(~home & pending)) + int(np.count_nonzero(~home & (mode_before == 1)))
+            removed += int(np.count_nonzero(home & pending & (mode_before == 2)))
+            written = np.flatnonzero(home & pending & (mode_before != 2)) - 1     # the G91 belongs after the move before the set home
+            if pending[0]:
+                keep_pending = len(written) > 0 and written[0] < 0
+            relative = np.zeros(len(home), dtype=bool)
+            relative[written[written >= 0]] = True
+            ends_pending = modes and not home[-1]
+            g._written_mode = {1: 'G90', 2: 'G91'}.get(int(mode_after[-1]), g._written_mode)
+        def mode_lines(k, rows):
+            if not modes:
+                return '', ''
+            at = np.searchsorted(mode_key, keys(k, rows))
+            return np.where(absolute[at], ABSOLUTE_LINE, '').astype(object), np.where(relative[at], RELATIVE_LINE, '').astype(object)
+
+        # with peephole a feed is left out if it sets the feed rate last written
+        feeds = [(keys(k, np.flatnonzero(rows)), rates[rows]) for k, (kind, rates, rows) in enumerate(self._commands) if kind == 'feed']
+        feed_key = np.concatenate([np.empty(0, dtype=int)] + [key for key, _ in feeds])
+        feed_rate = np.concatenate([rates for _, rates in feeds]) if feeds else np.empty(0)
+        order = np.argsort(feed_key, kind='stable')
+        feed_key, feed_rate = feed_key[order], feed_rate[order]
+        repeated = np.zeros(len(feed_key), dtype=bool)
+        if g.peephole and len(feed_key):
+            written_feed = np.nan if g._written_feed is None else float(g._written_feed)
+            repeated = feed_rate.astype(float) == np.concatenate(([written_feed], feed_rate[:-1].astype(float)))
+            removed += int(repeated.sum())
+
+        # the template of every command in every row, and the values filled into them, in the order they're written
+        templates = np.full((self.rows, n), '', dtype=object)
+        counts = np.zeros((self.rows, n), dtype=int)
+        fills = []      # (command, rows, values of each row, or for abs_moves the index of each point in its row)
+        for k, (kind, arguments, rows) in enumerate(self._commands):
+            rows = np.flatnonzero(rows)
+            if kind == 'line':
+                template, values = arguments
+                templates[rows, k] = template
+                counts[rows, k] = len(values)
+                fills.append((k, rows, [values[rows] for values in values]))
+            elif kind == 'feed':
+                rows = rows[~repeated[np.searchsorted(feed_key, keys(k, rows))]]
+                templates[rows, k] = FEED_LINE
+                counts[rows, k] = 1
+                fills.append((k, rows, [arguments[rows]]))
+            elif kind in ('move', 'home') and arguments:
+                row_codes = np.column_stack(axis_codes(k, rows, arguments))
+                unique_codes, group = np.unique(row_codes @ len(names) ** np.arange(len(arguments)), return_index=True, return_inverse=True)[1:]
+                template = g._move_template if kind == 'move' else g._home_template
+                lines = np.array([template(tuple(names[c] for c in row)) for row in row_codes[unique_codes].tolist()] + [''], dtype=object)
+                skip = noop[moves[k]:moves[k] + len(rows)] if kind == 'move' else np.zeros(len(rows), dtype=bool)
+                before, after = mode_lines(k, rows) if kind == 'move' else ('', '')
+                templates[rows, k] = before + lines[np.where(skip, -1, group.ravel())] + after
+                counts[rows, k] = np.where(skip, 0, len(arguments))
+                fills.append((k, rows[~skip], [values[rows[~skip]] for _, values in arguments]))
+            elif kind == 'moves':
+                points, _ = arguments
+                start, index, lengths = moves[k]
+                kept = ~noop[start:start + len(index)]
+                row_of_point = np.repeat(np.arange(len(rows)), lengths)
+                kept_lengths = np.bincount(row_of_point[kept], minlength=len(rows))
+                before, after = mode_lines(k, rows)
+                move_line = np.array([g._move_template((g.x_axis, g.y_axis))], dtype=object)
+                templates[rows, k] = before + move_line * kept_lengths + after
+                counts[rows, k] = 2 * kept_lengths
+                rank = np.arange(kept.sum()) - np.repeat(np.cumsum(kept_lengths) - kept_lengths, kept_lengths)
+                fills.append((k, rows[row_of_point[kept]], (points[index[kept]], rank)))
+                if modes:
+                    removed += 2 * int((lengths - 1).sum())     # the modes around every point after the first
+        counts = counts.ravel()
+        starts = np.cumsum(counts) - counts
+        values = np.empty(int(counts.sum()), dtype=object)
+        for k, rows, columns in fills:
+            if isinstance(columns, tuple):
+                points, rank = columns
+                at = starts[rows * n + k] + 2 * rank
+                values[at], values[at + 1] = points[:, 0], points[:, 1]
+                continue
+            at = starts[rows * n + k]
+            for j, column in enumerate(columns):
+                values[at + j] = column.tolist()
+
+        # a G91 left pending by the last move belongs right after it, before the lines of the commands after it
+        templates = templates.ravel().tolist()
+        split = len(templates)
+        if ends_pending and homes_and_moves[0]:
+            split = int(mode_key[-1]) // span + 1
+        split_values = int(starts[split]) if split < len(starts) else len(values)
+        values = values.tolist()
+
+        if keep_pending is not None:
+            g._buffer[g._pending_relative] = RELATIVE_LINE if keep_pending else ''
+            g._pending_relative = None
+        g._buffer.append(''.join(templates[:split]))
+        g._values += values[:split_values]
+        if ends_pending and g._pending_relative is None:
+            g._buffer.append('')
+            g._pending_relative = len(g._buffer) - 1
+        g._buffer.append(''.join(templates[split:]))
+        g._values += values[split_values:]
+        if g._pending_relative is None:
+            g.flush()
+        g.removed_lines += removed
+
+        # leaves the position, feed rate and z axis name where the row by row commands would have
+        for i in np.flatnonzero(last).tolist():
+            name = names[axis[i]]
+            if name == g.x_axis:
+                g._current_position['x'] = float(value[i])
+            elif name == g.y_axis:
+                g._current_position['y'] = float(value[i])
+            if name not in ('X', 'Y', 'Z'):
+                g._current_position[name] = float(value[i])
+        if np.any(is_z):
+            g._current_position['z'] = float(value[is_z][np.argmax(key[is_z])])
+        if len(feed_key):
+            g.speed = feed_rate[-1].item()
+            if g.peephole and not np.all(repeated):
+                g._written_feed = feed_rate[~repeated][-1].item()
+        if len(rename_keys):
+            g.z_axis = names[rename_codes[-1]]
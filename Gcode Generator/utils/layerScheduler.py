@@ -0,0 +1,141 @@
+from collections import namedtuple
+import numpy as np
+
+# a single print job: print layer layer_index_z (1 indexed) of the edge at position edge in the edge list
+# if reverse is true the edge is printed from node2 to node1
+PrintJob = namedtuple('PrintJob', ['edge', 'layer_index_z', 'reverse'], defaults=[False])
+
+# policies for batching edges of the same material within a speed/layer group
+#   'off'   - edges keep their input order, a travel optimizer only reorders runs of consecutive edges of the same material
+#   'group' - edges are grouped by material, lowest material index first
+#   'carry' - edges are grouped by material, starting with the material loaded at the end of the previous group
+MATERIAL_BATCHING_POLICIES = ['off', 'group', 'carry']
+
+# plans the order edges are printed in: grouped by speed from fastest to slowest to prevent material dragging,
+# and within each speed group the edges are interleaved layer by layer (every edge's first layer, then every second layer, etc)
+# if materials are given, the edges of each speed/layer group can be batched by material to cut nozzle swaps
+# if a travel optimizer is given, the edges of each material batch (or run of same material edges) are reordered to cut travel between them
+class LayerScheduler:
+    def __init__(self, print_speeds, numlayers_z, materials=None, material_batching='off', travel_optimizer=None):
+        self.print_speeds = np.asarray(print_speeds, dtype=float)
+        self.numlayers_z = np.asarray(numlayers_z, dtype=int)
+        self.materials = None if materials is None else np.asarray(materials, dtype=int)
+
+        if len(self.print_speeds) != len(self.numlayers_z) or (self.materials is not None and len(self.materials) != len(self.print_speeds)):
+            raise Exception("ERROR: Print speeds, number of layers, and materials must be given for every edge.")
+        if np.any(self.numlayers_z < 1):
+            raise Exception(f"ERROR: Number of layers must be greater than 0 (edges {np.flatnonzero(self.numlayers_z < 1).tolist()}).")
+        if material_batching not in MATERIAL_BATCHING_POLICIES:
+            raise Exception(f"ERROR: Material batching policy must be one of {MATERIAL_BATCHING_POLICIES}.")
+        if material_batching != 'off' and self.materials is None:
+            raise Exception("ERROR: Materials must be given to batch edges by material.")
+
+        self.material_batching = material_batching
+        self.travel_optimizer = travel_optimizer
+        self.stats = {}     # filled in when the plan is built
+        self._plan = None
+
+    def __len__(self):
+        return int(self.numlayers_z.sum())
+
+    def __iter__(self):
+        return iter(self.plan())
+
+    # returns the edge positions grouped by speed, fastest first, keeping the input order within each group
+    def speed_groups(self):
+        order = np.argsort(-self.print_speeds, kind='stable')
+        sorted_speeds = self.print_speeds[order]
+        if len(order) == 0:
+            return []
+        splits = np.flatnonzero(sorted_speeds[1:] != sorted_speeds[:-1]) + 1
+        return list(zip(sorted_speeds[np.concatenate(([0], splits))], np.split(order, splits)))
+
+    # yields (speed, layer index, edge positions) for every layer of every speed group in print order
+    # each edge is touched once per layer it has, so the whole plan is linear in the number of print jobs
+    def layer_groups(self):
+        for speed, edges in self.speed_groups():
+            layer_index_z = 1
+            while len(edges) > 0:
+                yield speed, layer_index_z, edges
+                edges = edges[self.numlayers_z[edges] > layer_index_z]   # drops edges that are done after this layer
+                layer_index_z += 1
+
+    # returns the full list of print jobs in print order
+    def plan(self):
+        edges, layers, reverse = self.plan_arrays()
+        return [PrintJob(edge, layer_index_z, flip) for edge, layer_index_z, flip in zip(edges.tolist(), layers.tolist(), reverse.tolist())]
+
+    # returns the plan as three arrays with one entry per print job: edge positions, layer indices (1 indexed) and reverse flags
+    # the plan is built and kept in this form, so large networks don't need a python object per print job
+    def plan_arrays(self):
+        if self._plan is None:
+            self._plan = self._build_plan(self.material_batching, self.travel_optimizer)
+
+            # compares against the plain plan to report what the optimizations saved
+            if self.material_batching != 'off' or self.travel_optimizer is not None:
+                unoptimized = self._build_plan('off', None)
+                if self.materials is not None:
+                    self.stats['swaps_before'] = self._count_material_swaps(unoptimized[0])
+                    self.stats['swaps_after'] = self._count_material_swaps(self._plan[0])
+                if self.travel_optimizer is not None:
+                    self.stats['travel_before_mm'] = self._travel_distance(unoptimized[0], unoptimized[2])
+                    self.stats['travel_after_mm'] = self._travel_distance(self._plan[0], self._plan[2])
+        return self._plan
+
+    # returns the number of material swaps a plan needs, the printer starts out on material index 0
+    def count_material_swaps(self, plan):
+        return self._count_material_swaps(np.array([job.edge for job in plan], dtype=int))
+
+    # returns the xy travel distance between edges of a plan, the printer starts out at the origin
+    def travel_distance(self, plan):
+        return self._travel_distance(np.array([job.edge for job in plan], dtype=int), np.array([job.reverse for job in plan], dtype=bool))
+
+    def _count_material_swaps(self, edges):
+        if len(edges) == 0:
+            return 0
+        materials = self.materials[edges]
+        return int(materials[0] != 0) + int(np.count_nonzero(materials[1:] != materials[:-1]))
+
+    def _travel_distance(self, edges, reverse):
+        distance, _ = self.travel_optimizer.travel_distance(edges, reverse)
+        return distance
+
+    def _build_plan(self, material_batching, travel_optimizer):
+        plan_edges, plan_layers, plan_reverse = [], [], []
+        material_index = 0
+        position = (0, 0)
+        for _, layer_index_z, edges in self.layer_groups():
+            for batch in self._material_batches(edges, material_index, material_batching):
+                reverse = np.zeros(len(batch), dtype=bool)
+                if travel_optimizer is not None:
+                    # each batch starts where the previous one ended, in the coordinates of the nozzle loaded then
+                    batch, reverse = travel_optimizer.order(batch, position, material_index)
+                    _, position = travel_optimizer.travel_distance(batch, reverse, position, material_index)
+                plan_edges.append(np.asarray(batch, dtype=int))
+                plan_layers.append(np.full(len(batch), layer_index_z))
+                plan_reverse.append(np.asarray(reverse, dtype=bool))
+
+                if self.materials is not None and len(batch) > 0:
+                    material_index = self.materials[batch[-1]]
+        if not plan_edges:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0, dtype=bool)
+        return np.concatenate(plan_edges), np.concatenate(plan_layers), np.concatenate(plan_reverse)
+
+    # splits a speed/layer group into the batches of edges that are printed one after another
+    # without batching every run of consecutive same material edges is its own batch, so reordering one can't add swaps
+    def _material_batches(self, edges, material_index, material_batching):
+        if material_batching == 'off':
+            if self.materials is None:
+                return [edges]
+            materials = self.materials[edges]
+            return np.split(edges, np.flatnonzero(materials[1:] != materials[:-1]) + 1)
+
+        edges = edges[np.argsort(self.materials[edges], kind='stable')]
+        materials = self.materials[edges]
+        splits = np.flatnonzero(materials[1:] != materials[:-1]) + 1
+        batches = np.split(edges, splits)
+
+        # moves the batch of the currently loaded material to the front so the group starts without a swap
+        if material_batching == 'carry':
+            batches.sort(key=lambda batch: self.materials[batch[0]] != material_index)
+        return batches
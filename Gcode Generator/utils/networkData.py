@@ -0,0 +1,97 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# a network is either an excel workbook with 'Nodes' and 'Edges' sheets,
+# or a pair of csv/parquet tables named <name>_Nodes.<ext> and <name>_Edges.<ext>, referred to by the path of the edges table
+WORKBOOK_SUFFIXES = ['.xlsx', '.xls']
+TABLE_SUFFIXES = ['.csv', '.parquet']
+NODES_SUFFIX = '_Nodes'
+EDGES_SUFFIX = '_Edges'
+
+# returns the paths of all networks in a folder, sorted by name
+def find_networks(folder):
+    folder = Path(folder)
+    paths = [path for suffix in WORKBOOK_SUFFIXES for path in folder.glob(f'*{suffix}') if not path.name.startswith('~$')]  # skips excel lock files
+    paths += [path for suffix in TABLE_SUFFIXES for path in folder.glob(f'*{EDGES_SUFFIX}{suffix}')]
+    return sorted(paths)
+
+# returns the name of a network, used to name its output files
+def network_name(path):
+    path = Path(path)
+    if path.suffix in TABLE_SUFFIXES and path.stem.endswith(EDGES_SUFFIX):
+        return path.stem[:-len(EDGES_SUFFIX)]
+    return path.stem
+
+# returns the path of the nodes table that goes with an edges table
+def nodes_path(edges_path):
+    edges_path = Path(edges_path)
+    if not edges_path.stem.endswith(EDGES_SUFFIX):
+        raise Exception(f"ERROR: Edge tables must be named <name>{EDGES_SUFFIX}{edges_path.suffix}, got {edges_path.name}.")
+    return edges_path.with_name(network_name(edges_path) + NODES_SUFFIX + edges_path.suffix)
+
+# returns the paths of all files a network is read from
+def network_files(path):
+    path = Path(path)
+    if path.suffix in TABLE_SUFFIXES:
+        return [nodes_path(path), path]
+    return [path]
+
+# reads in the node and edge dataframes of a network
+def load_network(path):
+    path = Path(path)
+    if path.suffix in WORKBOOK_SUFFIXES:
+        df = pd.read_excel(io=path, sheet_name=['Nodes','Edges']) # reads in the two sheets of the excel file
+        return df['Nodes'], df['Edges']
+    if path.suffix == '.csv':
+        return pd.read_csv(nodes_path(path)), pd.read_csv(path)
+    if path.suffix == '.parquet':
+        return pd.read_parquet(nodes_path(path)), pd.read_parquet(path)
+    raise Exception(f"ERROR: Unsupported network file {path.name}, must be one of {WORKBOOK_SUFFIXES + TABLE_SUFFIXES}.")
+
+# writes the node and edge dataframes of a network back to the same kind of file it was read from
+def save_network(path, node_df, edge_df):
+    path = Path(path)
+    if path.suffix in WORKBOOK_SUFFIXES:
+        with pd.ExcelWriter(path) as writer:
+            node_df.to_excel(writer, sheet_name='Nodes', index=False)
+            edge_df.to_excel(writer, sheet_name='Edges', index=False)
+    elif path.suffix == '.csv':
+        node_df.to_csv(nodes_path(path), index=False)
+        edge_df.to_csv(path, index=False)
+    elif path.suffix == '.parquet':
+        node_df.to_parquet(nodes_path(path), index=False)
+        edge_df.to_parquet(path, index=False)
+    else:
+        raise Exception(f"ERROR: Unsupported network file {path.name}, must be one of {WORKBOOK_SUFFIXES + TABLE_SUFFIXES}.")
+
+# fields of the structured array every edge is stored in, node1/node2 are zero indexed positions into the node arrays
+EDGE_DTYPE = np.dtype([('material_index', np.int64), ('node1', np.int64), ('node2', np.int64),
+                       ('print_speed_mmps', np.float64), ('print_pressure_psi', np.float64),
+                       ('xy_spacing_mm', np.float64), ('numpaths_xy', np.int64),
+                       ('firstlayerheight_mm', np.float64), ('z_layerheight_mm', np.float64), ('numlayers_z', np.int64)])
+
+# converts the node and edge dataframes of a network (with print variables added) to compact arrays:
+# an (n, 2) array of node x/y positions and a structured array of edges with the EDGE_DTYPE fields
+# node numbers in EndNodes_1/EndNodes_2 start at 1 and refer to rows of the nodes sheet, they are all checked here at once
+def network_arrays(node_df, edge_df):
+    nodes = node_df[['x', 'y']].to_numpy(dtype=float)
+
+    edges = np.empty(len(edge_df), dtype=EDGE_DTYPE)
+    # if the stimulus column doesn't exist, assume single material print
+    if 'stimulus' in edge_df.columns:
+        edges['material_index'] = pd.to_numeric(edge_df['stimulus'], errors='coerce').fillna(0).astype(int).to_numpy()
+    else:
+        edges['material_index'] = 0
+
+    for field, column in [('node1', 'EndNodes_1'), ('node2', 'EndNodes_2')]:
+        node_numbers = pd.to_numeric(edge_df[column], errors='coerce').to_numpy(dtype=float)
+        invalid = ~np.isfinite(node_numbers) | (node_numbers != np.round(node_numbers)) | (node_numbers < 1) | (node_numbers > len(nodes))
+        if invalid.any():
+            bad = edge_df[column][invalid].unique()[:10].tolist()
+            raise Exception(f"ERROR: {column} must hold node numbers between 1 and {len(nodes)}, found {bad} in {invalid.sum()} edges.")
+        edges[field] = node_numbers.astype(int) - 1    # subtract 1 because node numbers start at 1 in the excel file and arrays are zero-indexed
+
+    for field in ['print_speed_mmps', 'print_pressure_psi', 'xy_spacing_mm', 'numpaths_xy', 'firstlayerheight_mm', 'z_layerheight_mm', 'numlayers_z']:
+        edges[field] = edge_df[field].to_numpy()
+    return nodes, edges
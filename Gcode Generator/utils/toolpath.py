@@ -0,0 +1,132 @@
+import numpy as np
+
+# dwell at the end of the aerotech togglePress function in the mecode footer, paid on every pressure toggle
+TOGGLE_PRESSURE_DWELL = 0.15  # s
+
+# columns of the recorded move table, one row per move
+MOVE_COLUMNS = ['x0', 'y0', 'z0', 'x1', 'y1', 'z1', 'feed', 'extruding', 'material']
+
+# sits in front of a gcode emitter (mecode G or StreamingG), records every move, dwell and pressure command and forwards it
+# positions are recorded in design coordinates, i.e. in the frame of the nozzle making the move, and z is the height of that nozzle's z axis
+# material_axes maps each z axis name to the index of the material printed through it
+class ToolpathRecorder:
+    def __init__(self, g, material_axes):
+        self.g = g
+        self.material_axes = material_axes
+        self.z_axis = None
+        self.x, self.y = 0.0, 0.0   # the printer starts out at the origin
+        self.z = {}                 # height of each z axis, unknown until it is first moved
+        self.feed_rate = np.nan
+        self.pressurized = set()    # pressure box COM ports that are currently on
+        self.material_swaps = 0
+        self.pressure_toggles = 0
+        self.pressure_sets = 0
+        self.dwells = []
+        self._rows = []     # single moves not yet added to the chunks
+        self._chunks = []   # arrays of moves, in order
+
+    # anything that isn't recorded goes straight to the emitter
+    def __getattr__(self, name):
+        return getattr(self.g, name)
+
+    def rename_axis(self, x=None, y=None, z=None):
+        if z is not None:
+            if self.z_axis is not None and z != self.z_axis:
+                self.material_swaps += 1
+            self.z_axis = z
+        self.g.rename_axis(x=x, y=y, z=z)
+
+    # setting home moves nothing, it only changes the coordinates the following moves are recorded in
+    def set_home(self, x=None, y=None, z=None, **kwargs):
+        if x is not None:
+            self.x = x
+        if y is not None:
+            self.y = y
+        if z is not None:
+            self.z[self.z_axis] = z
+        self.g.set_home(x=x, y=y, z=z, **kwargs)
+
+    def feed(self, rate):
+        self.feed_rate = rate
+        self.g.feed(rate)
+
+    def dwell(self, time):
+        self.dwells.append(time)
+        self.g.dwell(time)
+
+    def set_pressure(self, com_port, value):
+        self.pressure_sets += 1
+        self.g.set_pressure(com_port, value)
+
+    def toggle_pressure(self, com_port):
+        self.pressure_toggles += 1
+        self.pressurized ^= {com_port}
+        self.g.toggle_pressure(com_port)
+
+    # records one move, axes other than x, y and z (the C axis follows z) don't change the path
+    def abs_move(self, x=None, y=None, z=None, **kwargs):
+        z0 = self.z.get(self.z_axis, np.nan)
+        x1 = self.x if x is None else x
+        y1 = self.y if y is None else y
+        z1 = z0 if z is None else z
+        self._rows.append((self.x, self.y, z0, x1, y1, z1, self.feed_rate, bool(self.pressurized), self._material()))
+        self.x, self.y, self.z[self.z_axis] = x1, y1, z1
+        self.g.abs_move(x=x, y=y, z=z, **kwargs)
+
+    # records an (n, 2) array of xy moves at once
+    def abs_moves(self, points):
+        points = np.asarray(points, dtype=float)
+        if len(points) == 0:
+            return
+        self._flush_rows()
+        moves = np.empty((len(points), len(MOVE_COLUMNS)))
+        moves[0, :2] = self.x, self.y
+        moves[1:, :2] = points[:-1]
+        moves[:, 3:5] = points
+        moves[:, [2, 5]] = self.z.get(self.z_axis, np.nan)
+        moves[:, 6:] = self.feed_rate, bool(self.pressurized), self._material()
+        self._chunks.append(moves)
+        self.x, self.y = float(points[-1, 0]), float(points[-1, 1])
+        self.g.abs_moves(points)
+
+    # returns the (n, len(MOVE_COLUMNS)) array of every move recorded so far
+    def moves(self):
+        self._flush_rows()
+        if not self._chunks:
+            return np.empty((0, len(MOVE_COLUMNS)))
+        self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0]
+
+    # estimates the machine time and path lengths of the recorded program, ignoring acceleration
+    # moves take their length over the active feed rate, and every dwell and pressure toggle adds its dwell time
+    # moves of a z axis from an unknown height are counted as zero length
+    def summary(self):
+        moves = self.moves()
+        start, end = moves[:, 0:3], moves[:, 3:6]
+        xy_length = np.hypot(end[:, 0] - start[:, 0], end[:, 1] - start[:, 1])
+        z_length = np.nan_to_num(np.abs(end[:, 2] - start[:, 2]))
+        length = np.hypot(xy_length, z_length)
+        time = np.divide(length, moves[:, 6], out=np.zeros(len(moves)), where=length > 0)
+        extruding = moves[:, 7].astype(bool)
+        materials = moves[:, 8].astype(int)
+
+        dwell_time_s = float(np.sum(self.dwells)) + self.pressure_toggles * TOGGLE_PRESSURE_DWELL
+        return {'moves': len(moves),
+                'estimated_time_s': float(time.sum()) + dwell_time_s,
+                'print_time_s': float(time[extruding].sum()),
+                'travel_time_s': float(time[~extruding].sum()),
+                'dwell_time_s': dwell_time_s,
+                'extruded_mm': {int(material): float(length[extruding & (materials == material)].sum()) for material in np.unique(materials[extruding])},
+                'travel_xy_mm': float(xy_length[~extruding].sum()),
+                'travel_z_mm': float(z_length[~extruding].sum()),
+                'material_swaps': self.material_swaps,
+                'pressure_toggles': self.pressure_toggles,
+                'pressure_sets': self.pressure_sets}
+
+    def _material(self):
+        return self.material_axes.get(self.z_axis, -1)
+
+    def _flush_rows(self):
+        if self._rows:
+            self._chunks.append(np.array(self._rows, dtype=float))
+            self._rows = []
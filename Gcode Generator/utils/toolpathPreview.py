@@ -0,0 +1,61 @@
+from pathlib import Path
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from matplotlib import colormaps
+from utils.toolpath import MOVE_COLUMNS
+
+# colormap of each material index, each layer of a material gets a darker shade the higher it is printed
+MATERIAL_COLORMAPS = ['Blues', 'Oranges', 'Greens', 'Purples', 'Reds', 'Greys']
+TRAVEL_COLOR = (0.6, 0.6, 0.6, 0.5)
+
+# renders the moves recorded by a ToolpathRecorder to a png without opening a window, so it works without a display
+# extrusion is colored by material and layer (print height), travel is drawn as thin grey lines if show_travel is true
+# every segment is drawn in a single LineCollection per kind, so large programs render in seconds
+def render_preview(moves, outpath, size_px=2000, show_travel=True, title=None):
+    moves = np.asarray(moves, dtype=float).reshape(-1, len(MOVE_COLUMNS))
+    segments = moves[:, [0, 1, 3, 4]].reshape(-1, 2, 2)
+    xy_moves = np.any(segments[:, 0] != segments[:, 1], axis=1)    # z only moves don't show up from above
+    extruding = moves[:, 7].astype(bool) & xy_moves
+    travelling = ~moves[:, 7].astype(bool) & xy_moves
+    materials = moves[:, 8].astype(int)
+
+    # the longer side of the image is size_px, the other follows the aspect ratio of the toolpath
+    shown = segments[extruding | (travelling & show_travel)].reshape(-1, 2)
+    aspect = 1
+    if len(shown) > 0:
+        low, high = shown.min(axis=0) - 1, shown.max(axis=0) + 1
+        aspect = np.clip((high[1] - low[1]) / (high[0] - low[0]), 0.25, 4)
+    fig = Figure(figsize=(size_px / 100 * min(1, 1 / aspect), size_px / 100 * min(1, aspect)), dpi=100, layout='tight')
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    if show_travel and travelling.any():
+        ax.add_collection(LineCollection(segments[travelling], colors=[TRAVEL_COLOR], linewidths=0.3))
+
+    colors = np.zeros((len(moves), 4))
+    handles = [Line2D([], [], color=TRAVEL_COLOR, label='travel')] if show_travel and travelling.any() else []
+    for material in np.unique(materials[extruding]):
+        selected = extruding & (materials == material)
+        heights, layers = np.unique(np.round(moves[selected, 5], 6), return_inverse=True)
+        shade = 0.4 + 0.6 * (layers + 1) / len(heights)
+        colormap = colormaps[MATERIAL_COLORMAPS[material % len(MATERIAL_COLORMAPS)]]
+        colors[selected] = colormap(shade)
+        handles.append(Line2D([], [], color=colormap(1.0), label=f'material {material} ({len(heights)} layers)'))
+    if extruding.any():
+        ax.add_collection(LineCollection(segments[extruding], colors=colors[extruding], linewidths=0.8))
+
+    if len(shown) > 0:
+        ax.set_xlim(low[0], high[0])
+        ax.set_ylim(low[1], high[1])
+    ax.set_aspect('equal')
+    ax.set_xlabel('x (mm)')
+    ax.set_ylabel('y (mm)')
+    if title is not None:
+        ax.set_title(title)
+    if handles:
+        ax.legend(handles=handles, loc='upper right')
+    fig.savefig(Path(outpath))
+    return outpath
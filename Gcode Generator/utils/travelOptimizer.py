@@ -0,0 +1,159 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# reorders the edges of a speed/layer group and picks which end each edge starts from to cut travel between edges
+# edges are ordered with a nearest neighbour pass over a kd-tree of the edge end nodes, then refined with 2-opt
+# an edge with an odd number of meander paths finishes at its far node, an even one finishes back at its start node
+# a reversed edge has to be printed with its meander mirrored to cover the same stripe (see gcodeLibrary.meander_waypoints),
+# set allow_reverse=False to keep every edge's direction
+# if materials and the (number of materials, 2) home_positions of their nozzles are given, travel is measured the way the
+# printer moves: a material swap sets the new nozzle's home, which shifts the coordinates of the travel after it by the home offset
+class TravelOptimizer:
+    def __init__(self, x0, y0, x1, y1, numpaths_xy, materials=None, home_positions=None, allow_reverse=True, two_opt=True, neighbours=8, max_passes=10):
+        self.node1 = np.column_stack([x0, y0]).astype(float)
+        self.node2 = np.column_stack([x1, y1]).astype(float)
+        self.odd = np.asarray(numpaths_xy, dtype=int) % 2 == 1
+        self.materials = np.zeros(len(self.node1), dtype=int) if materials is None else np.asarray(materials, dtype=int)
+        self.home_positions = np.zeros((self.materials.max(initial=0) + 1, 2)) if home_positions is None else np.asarray(home_positions, dtype=float).reshape(-1, 2)
+        self.allow_reverse = allow_reverse
+        self.two_opt = two_opt and allow_reverse    # reversing a segment of the route flips the direction of its odd edges
+        self.neighbours = neighbours
+        self.max_passes = max_passes
+
+    # returns the points where the nozzle enters and leaves each edge
+    def endpoints(self, edges, reverse):
+        reverse = np.asarray(reverse, dtype=bool)[:, None]
+        entry = np.where(reverse, self.node2[edges], self.node1[edges])
+        far = np.where(reverse, self.node1[edges], self.node2[edges])
+        exit = np.where(self.odd[edges][:, None], far, entry)
+        return entry, exit
+
+    # returns position, given in the coordinates of from_material's nozzle, in the coordinates of to_material's nozzle
+    def shift_home(self, position, from_material, to_material):
+        return np.asarray(position, dtype=float) - (self.home_positions[to_material] - self.home_positions[from_material])
+
+    # returns the xy travel distance of printing edges in the given order and the position the nozzle ends at
+    # start is given in the coordinates of start_material's nozzle, the end position in the coordinates of the last edge's nozzle
+    def travel_distance(self, edges, reverse, start=(0, 0), start_material=0):
+        start = np.asarray(start, dtype=float)
+        edges = np.asarray(edges, dtype=int)
+        if len(edges) == 0:
+            return 0.0, start
+        entry, exit = self.endpoints(edges, reverse)
+        materials = self.materials[edges]
+        previous = self.shift_home(np.vstack([start, exit[:-1]]), np.concatenate(([start_material], materials[:-1])), materials)
+        return float(np.linalg.norm(entry - previous, axis=1).sum()), exit[-1]
+
+    # returns the edges reordered to minimize travel starting from start, and whether each one is printed from node2 to node1
+    # the edges are expected to share a material, start is given in the coordinates of start_material's nozzle
+    def order(self, edges, start=(0, 0), start_material=0):
+        edges = np.asarray(edges)
+        if len(edges) > 0:
+            start = self.shift_home(start, start_material, self.materials[edges[0]])
+        if len(edges) < 2:
+            reverse = np.zeros(len(edges), dtype=bool)
+            if len(edges) == 1 and self.allow_reverse:
+                entry, _ = self.endpoints(edges, [False])
+                reverse[0] = np.linalg.norm(self.node2[edges[0]] - start) < np.linalg.norm(entry[0] - start)
+            return edges, reverse
+
+        route, reverse = self._nearest_neighbour(edges, np.asarray(start, dtype=float))
+        if self.two_opt:
+            route, reverse = self._two_opt(edges, route, reverse, np.asarray(start, dtype=float))
+        return edges[route], reverse
+
+    # greedily picks the closest unprinted edge end as the next edge to print
+    def _nearest_neighbour(self, edges, start):
+        n = len(edges)
+        # candidate entry points: node1 of every edge (forward), and node2 (reversed) if edges can be flipped
+        points = [self.node1[edges]]
+        owners = [np.arange(n)]
+        flips = [np.zeros(n, dtype=bool)]
+        if self.allow_reverse:
+            points.append(self.node2[edges])
+            owners.append(np.arange(n))
+            flips.append(np.ones(n, dtype=bool))
+        points, owners, flips = np.vstack(points), np.concatenate(owners), np.concatenate(flips)
+
+        visited = np.zeros(n, dtype=bool)
+        route = np.empty(n, dtype=int)
+        reverse = np.empty(n, dtype=bool)
+
+        # the tree is rebuilt from the unvisited candidates once half of it is used up, to keep queries short
+        live = np.arange(len(points))
+        tree = cKDTree(points[live])
+        used_since_build = 0
+        position = start
+        for step in range(n):
+            k = min(16, len(live))
+            while True:
+                _, hits = tree.query(position, k=k)
+                hits = np.atleast_1d(hits)
+                candidates = live[hits[hits < len(live)]]
+                candidates = candidates[~visited[owners[candidates]]]
+                if len(candidates) > 0 or k == len(live):
+                    break
+                k = min(k * 4, len(live))
+
+            best = candidates[0]
+            edge = owners[best]
+            visited[edge] = True
+            route[step] = edge
+            reverse[step] = flips[best]
+            entry, exit = self.endpoints(edges[[edge]], [flips[best]])
+            position = exit[0]
+
+            used_since_build += 1
+            if used_since_build * 2 >= len(live) and step < n - 1:
+                live = live[~visited[owners[live]]]
+                tree = cKDTree(points[live])
+                used_since_build = 0
+
+        return route, reverse
+
+    # improves the route by reversing segments of it while that shortens the travel
+    # only segments starting at an edge end near the previous exit are tried, found with a kd-tree over all edge ends
+    def _two_opt(self, edges, route, reverse, start):
+        n = len(route)
+        entry, exit = self.endpoints(edges[route], reverse)
+        odd = self.odd[edges[route]]
+        reverse = reverse.copy()
+        order = np.arange(n)    # order[i] is the slot of the i-th printed edge in entry/exit/odd/reverse
+        slot_position = np.arange(n)
+
+        ends = np.vstack([self.node1[edges[route]], self.node2[edges[route]]])
+        end_slots = np.concatenate([np.arange(n), np.arange(n)])
+        tree = cKDTree(ends)
+        k = min(self.neighbours * 2, len(ends))
+
+        for _ in range(self.max_passes):
+            improved = False
+            # candidate segment ends are looked up for the whole route at once at the start of each pass
+            _, hits = tree.query(np.vstack([start, exit[order[:-1]]]), k=k)
+            candidates = end_slots[hits.reshape(n, -1)]
+            for i in range(n):
+                previous = start if i == 0 else exit[order[i - 1]]
+                first = order[i]
+                j = slot_position[candidates[i]]
+                j = j[j >= i]
+                if len(j) == 0:
+                    continue
+                last = order[j]
+
+                # after reversing order[i:j+1] the segment is entered at the old exit of last and left at the old entry of first
+                delta = np.linalg.norm(exit[last] - previous, axis=1) - np.linalg.norm(entry[first] - previous)
+                following = entry[order[np.minimum(j + 1, n - 1)]]
+                delta += np.where(j < n - 1, np.linalg.norm(following - entry[first], axis=1) - np.linalg.norm(following - exit[last], axis=1), 0)
+
+                best = np.argmin(delta)
+                if delta[best] < -1e-9:
+                    segment = order[i:j[best] + 1][::-1].copy()
+                    order[i:j[best] + 1] = segment
+                    slot_position[segment] = np.arange(i, j[best] + 1)
+                    entry[segment], exit[segment] = exit[segment].copy(), entry[segment].copy()
+                    reverse[segment] ^= odd[segment]
+                    improved = True
+            if not improved:
+                break
+
+        return route[order], reverse[order]
@@ -2,13 +2,22 @@ import cv2
 from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 from openpyxl import Workbook
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+from matchNodes import load_design_nodes, match_nodes, unmatched_report, MAX_MATCH_DISTANCE
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))    # the repo folder, for the modules the analyzers share
+from watchFolder import append_csv, poll_folder
 
 SCALE_FACTOR = 41.9     # Pixels per mm
 MIN_AREA = 50           # Minimum area of the contour in pixels
 MAX_AREA = 5000         # Maximum area of the contour in pixels
 BLACK_THRESHOLD = 100   # Threshold to identify black pixels, out of 255
 
+OUTPUT_FORMATS = ['xlsx', 'csv', 'parquet']     # formats the batch results can be written in
+
 def plotImg(img):
     if len(img.shape) == 2:
         plt.imshow(img, cmap='gray')
@@ -17,90 +26,263 @@ def plotImg(img):
         plt.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
         plt.show()
 
-def analyze(image_path, output_folder, workbook):
-    # Load the image
-    img = cv2.imread(image_path)
+# K channel (of CMYK) of every possible max(B, G, R) value, computed the same way as converting the image to float would:
+# K = 1 - max(B, G, R) / 255, scaled back to uint8
+K_CHANNEL_LUT = (255 * (1 - np.arange(256) / 255.)).astype(np.uint8)
+# maps max(B, G, R) straight to the thresholded K channel, so images are binarized without a float copy
+BINARY_LUT = np.where(K_CHANNEL_LUT > BLACK_THRESHOLD, 255, 0).astype(np.uint8)
+TILE_OVERLAP = 256      # rows each tile reads past its own rows when thresholding in tiles, should be more than the tallest node
+
+# thresholds the K channel of an image, black pixels are 255 and the rest 0
+def binarize(img):
+    return cv2.LUT(np.max(img, axis=2), BINARY_LUT)
 
-    # Conversion to CMYK (just the K channel):
-    # Convert to float and divide by 255:
-    imgFloat = img.astype(float) / 255.
+# returns the external contours of the thresholded image, in the same order cv2.findContours returns them
+# if tile_height is given, the image is thresholded in strips of tile_height rows so only one strip is binarized at a time
+# each strip reads tile_overlap rows above and below itself and keeps the contours that start in its own rows,
+# if one of them runs off the bottom of the strip, the strip is read again with twice the overlap below
+def find_contours(img, tile_height=None, tile_overlap=TILE_OVERLAP):
+    if tile_height is None:
+        cnts, _ = cv2.findContours(binarize(img), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return cnts
 
-    # Calculate channel K:
-    kChannel = 1 - np.max(imgFloat, axis=2)
+    height = img.shape[0]
+    cnts = []
+    for y0 in range(0, height, tile_height):
+        y1 = min(y0 + tile_height, height)
+        top = max(y0 - tile_overlap, 0)
+        overlap = tile_overlap
+        while True:
+            bottom = min(y1 + overlap, height)
+            tile_cnts, _ = cv2.findContours(binarize(img[top:bottom]), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(0, top))
+            # a contour starts at its top left point, so each contour is kept by exactly one strip
+            tile_cnts = [c for c in tile_cnts if y0 <= c[0, 0, 1] < y1]
+            if bottom == height or all(c[:, 0, 1].max() < bottom - 1 for c in tile_cnts):
+                break
+            overlap *= 2
+        cnts += tile_cnts
 
-    # Convert back to uint 8:
-    kChannel = (255 * kChannel).astype(np.uint8)
+    # cv2.findContours returns contours from the last starting point to the first
+    cnts.sort(key=lambda c: (c[0, 0, 1], c[0, 0, 0]), reverse=True)
+    return cnts
 
-    # Threshold image:
-    _, binaryImage = cv2.threshold(kChannel, BLACK_THRESHOLD, 255, cv2.THRESH_BINARY)
-    # plotImg(binaryImage)
+# finds the nodes in an image and draws them on it if annotate is true, see find_contours for tile_height
+# returns a dict of node index to (x_mm, y_mm)
+def detect_nodes(img, annotate=True, tile_height=None):
+    # Searching for contours on the thresholded K channel of the image
+    cnts = find_contours(img, tile_height=tile_height)
 
-    # Searching for contours on threshold img
-    cnts, _ = cv2.findContours(binaryImage, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
     i = 0   # index to tag the contours
     data = {}
 
     for c in cnts:
         area = cv2.contourArea(c)
 
-        if area < MIN_AREA or area > MAX_AREA: 
+        if area < MIN_AREA or area > MAX_AREA:
             continue
 
-        rect = cv2.minAreaRect(c) 
-        box = cv2.boxPoints(rect)
-        box = np.intp(box)
+        rect = cv2.minAreaRect(c)
         (x, y), (w, h), angle = rect
 
         # ignores contours with aspect ratio thinner than 1:3 to avoid ruler tick marks
         if w/h < 1/3 or w/h > 3:
             continue
 
-        cv2.drawContours(img,[box],0,(0,255,0),2)
-
         x_mm = round(x/SCALE_FACTOR, 3)
-        y_mm = round(y/SCALE_FACTOR, 3)        
-
-        # tags each contour with index and saves to data dict
-        cv2.putText(img, f"{i}", (int(x+50), int(y)), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 0, 0), 5)
+        y_mm = round(y/SCALE_FACTOR, 3)
         data[i] = (x_mm, y_mm)
 
+        # tags each contour with index
+        if annotate:
+            box = np.intp(cv2.boxPoints(rect))
+            cv2.drawContours(img,[box],0,(0,255,0),2)
+            cv2.putText(img, f"{i}", (int(x+50), int(y)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 0, 0), 5)
+
         i+=1
-        
+
         # additional img labels that are not needed for now
-        # cv2.putText(img, f"x: {x/SCALE_FACTOR:.1f}", (int(x+50), int(y-20)), 
-        #             cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2) 
-        # cv2.putText(img, f"y: {y/SCALE_FACTOR:.1f}", (int(x+50), int(y+20)), 
-        #             cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2) 
-        # cv2.putText(img, f"area: {area}", (int(x), int(y)), 
-        #             cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2) 
-
-    cv2.putText(img, f"Filename: {str(image_path).split('/')[-1]}", (100, 100), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10) 
-    cv2.putText(img, f"Scale Factor: {SCALE_FACTOR}", (100, 200), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10)
-
-    # plotImg(img)
-    # Save the final image to output folder and data to excel
-    img_name = image_path.stem
-    cv2.imwrite(f"{output_folder}/{img_name}_analyzed.jpg", img)
-    ws = workbook.create_sheet(img_name)
+        # cv2.putText(img, f"x: {x/SCALE_FACTOR:.1f}", (int(x+50), int(y-20)),
+        #             cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
+        # cv2.putText(img, f"y: {y/SCALE_FACTOR:.1f}", (int(x+50), int(y+20)),
+        #             cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
+        # cv2.putText(img, f"area: {area}", (int(x), int(y)),
+        #             cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
+    return data
+
+# analyzes a single image and returns its result, a dict with the image name and its node positions (see detect_nodes)
+# the annotated image is written to the output folder if annotate is true, through image_writer (an executor) if one is given
+def analyze_image(image_path, output_folder, annotate=True, image_writer=None, tile_height=None):
+    image_path = Path(image_path)
+    img = cv2.imread(str(image_path))
+    if img is None:
+        raise Exception(f"ERROR: Could not read the image {image_path}.")
+    data = detect_nodes(img, annotate=annotate, tile_height=tile_height)
+
+    if annotate:
+        cv2.putText(img, f"Filename: {image_path.name}", (100, 100),
+                        cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10)
+        cv2.putText(img, f"Scale Factor: {SCALE_FACTOR}", (100, 200),
+                        cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10)
+        outpath = f"{output_folder}/{image_path.stem}_analyzed.jpg"
+        if image_writer is None:
+            cv2.imwrite(outpath, img)
+        else:
+            image_writer.submit(cv2.imwrite, outpath, img)
+    return {'image': image_path.stem, 'data': data}
+
+# analyzes an image and adds its data to a new sheet of the workbook
+def analyze(image_path, output_folder, workbook):
+    result = analyze_image(image_path, output_folder)
+    ws = workbook.create_sheet(result['image'])
 
     ws.append(["index","x_mm","y_mm"])
-    for key, val in data.items():
+    for key, val in result['data'].items():
         ws.append([key, val[0], val[1]])
 
+# analyzes every image, over a pool of worker processes if workers > 1 (None uses every CPU)
+# in serial runs the annotated images are written by a background thread while the next image is analyzed
+# an image that fails is reported and skipped instead of stopping the batch
+# returns the results of the images that succeeded in input order (see analyze_image) and a dict of image name to error message
+def analyze_batch(image_paths, output_folder, workers=1, annotate=True, tile_height=None):
+    results = []
+    failures = {}
+    if workers == 1:
+        with ThreadPoolExecutor(max_workers=1) as image_writer:
+            for image_path in image_paths:
+                print("Analyzing", image_path)
+                try:
+                    results.append(analyze_image(image_path, output_folder, annotate=annotate, image_writer=image_writer, tile_height=tile_height))
+                except Exception as e:
+                    failures[Path(image_path).name] = f"{type(e).__name__}: {e}"
+                    print(f"Failed to analyze {image_path}. Skipping...")
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(analyze_image, image_path, output_folder, annotate, None, tile_height) for image_path in image_paths]
+        for image_path, future in zip(image_paths, futures):  # results are collected in input order
+            try:
+                results.append(future.result())
+                print("Analyzed", image_path)
+            except Exception as e:
+                failures[Path(image_path).name] = f"{type(e).__name__}: {e}"
+                print(f"Failed to analyze {image_path}. Skipping...")
+    return results, failures
+
+# returns the results of analyze_batch as one table with a row per node
+def results_table(results):
+    rows = [(result['image'], key, val[0], val[1]) for result in results for key, val in result['data'].items()]
+    return pd.DataFrame(rows, columns=["image", "index", "x_mm", "y_mm"])
+
+# writes the results of analyze_batch to outpath, the format is one of OUTPUT_FORMATS
+# xlsx files get a sheet per image like analyze, and are streamed to disk with a write only workbook
+# csv and parquet files hold a single table with a row per node (see results_table)
+def write_results(results, outpath, output_format='xlsx'):
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"ERROR: Output format must be one of {OUTPUT_FORMATS}.")
+    if output_format == 'csv':
+        results_table(results).to_csv(outpath, index=False)
+    elif output_format == 'parquet':
+        results_table(results).to_parquet(outpath, index=False)
+    else:
+        wb = Workbook(write_only=True)
+        for result in results:
+            ws = wb.create_sheet(result['image'])
+            ws.append(["index","x_mm","y_mm"])
+            for key, val in result['data'].items():
+                ws.append([key, val[0], val[1]])
+        wb.save(outpath)
+
+# matches the nodes found in every result against the design node positions (see matchNodes.match_nodes)
+# an image that can't be matched (too few nodes found) is reported with nothing matched instead of stopping the batch
+# returns a table with a row per detected or unmatched design node of every image, and a table with the summary of every image
+def match_results(results, design, with_scale=False, flip_y=True, max_distance=MAX_MATCH_DISTANCE):
+    tables = []
+    summaries = []
+    for result in results:
+        detected = np.array(list(result['data'].values()), dtype=float).reshape(-1, 2)
+        try:
+            table, summary = match_nodes(detected, design, with_scale=with_scale, flip_y=flip_y, max_distance=max_distance)
+        except Exception as e:
+            print(f"Failed to match {result['image']} ({e}). Reporting it as unmatched...")
+            table, summary = unmatched_report(detected, design)
+        table.insert(0, 'image', result['image'])
+        tables.append(table)
+        summaries.append({'image': result['image'], **summary})
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(), pd.DataFrame(summaries)
+
+def print_match_summaries(summaries):
+    for summary in summaries.to_dict('records'):
+        print(f"{summary['image']}: matched {summary['matched']} of {summary['design']} design nodes, "
+              f"rms error {summary['rms_error_mm']:.3f} mm, max error {summary['max_error_mm']:.3f} mm")
+
+# writes a table in one of OUTPUT_FORMATS
+def write_table(df, outpath, output_format='xlsx'):
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"ERROR: Output format must be one of {OUTPUT_FORMATS}.")
+    if output_format == 'csv':
+        df.to_csv(outpath, index=False)
+    elif output_format == 'parquet':
+        df.to_parquet(outpath, index=False)
+    else:
+        df.to_excel(outpath, index=False)
+
+# watches the input folder and analyzes new or changed images as they arrive (see poll_folder)
+# results are appended to data.csv, and to matches.csv and match_summary.csv if design node positions are given, once every image of a poll is done
+# runs until interrupted, or for max_polls polls if given, and returns the number of images analyzed
+def watch(input_folder, output_folder, interval=2.0, workers=1, annotate=True, tile_height=None,
+          design=None, with_scale=False, flip_y=True, max_distance=MAX_MATCH_DISTANCE, max_polls=None):
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    def process(image_paths):
+        results, failures = analyze_batch(image_paths, output_folder, workers=workers, annotate=annotate, tile_height=tile_height)
+        if design is not None and results:
+            matches, summaries = match_results(results, design, with_scale=with_scale, flip_y=flip_y, max_distance=max_distance)
+        append_csv(results_table(results), output_folder / "data.csv")
+        if design is not None and results:
+            append_csv(matches, output_folder / "matches.csv")
+            append_csv(summaries, output_folder / "match_summary.csv")
+            print_match_summaries(summaries)
+        return failures
+
+    analyzed = poll_folder(input_folder, output_folder, process, interval=interval, max_polls=max_polls)
+    print(f"Analyzed {analyzed} new images")
+    return analyzed
+
 if __name__ == '__main__':
-    input_folder = Path(__file__).parent / "input"
-    output_folder = Path(__file__).parent / "output"
+    parser = argparse.ArgumentParser(description="Finds the node positions in every image in the input folder.")
+    parser.add_argument('--input', type=Path, default=Path(__file__).parent / "input", help="folder with the *.JPG images")
+    parser.add_argument('--output', type=Path, default=Path(__file__).parent / "output", help="folder the data and annotated images are written to")
+    parser.add_argument('--workers', type=int, default=1, help="number of images to analyze in parallel")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='xlsx', help="format of the data file")
+    parser.add_argument('--tile-height', type=int, default=None, help="threshold very large images in strips of this many rows to bound memory")
+    parser.add_argument('--no-annotate', action='store_true', help="don't write the annotated images")
+    parser.add_argument('--design', type=Path, default=None, help="network workbook (or nodes table) to match the detected nodes against")
+    parser.add_argument('--match-distance', type=float, default=MAX_MATCH_DISTANCE, help="furthest a detected node can be from its design node, in mm")
+    parser.add_argument('--similarity', action='store_true', help="also fit a scale when registering the detected nodes to the design")
+    parser.add_argument('--no-flip-y', action='store_true', help="don't flip the image y axis when registering to the design")
+    parser.add_argument('--watch', action='store_true', help="keep watching the input folder and analyze new images as they arrive, appending to csv files")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between polls of the input folder when watching")
+    args = parser.parse_args()
 
-    wb = Workbook() # to save the data
+    if args.watch:
+        design = load_design_nodes(args.design) if args.design is not None else None
+        watch(args.input, args.output, interval=args.interval, workers=args.workers, annotate=not args.no_annotate, tile_height=args.tile_height,
+              design=design, with_scale=args.similarity, flip_y=not args.no_flip_y, max_distance=args.match_distance)
+    else:
+        # loop through all the images in the input folder using pathlib
+        image_paths = sorted(Path(args.input).glob("*.JPG"))
+        results, failures = analyze_batch(image_paths, args.output, workers=args.workers, annotate=not args.no_annotate, tile_height=args.tile_height)
+        write_results(results, f"{args.output}/data.{args.format}", args.format)
 
-    # loop through all the images in the input folder using pathlib
-    for file in Path(input_folder).glob("*.JPG"):
-        print("Analyzing", file)
-        analyze(image_path=file, output_folder=output_folder, workbook=wb)
+        if args.design is not None:
+            matches, summaries = match_results(results, load_design_nodes(args.design), with_scale=args.similarity,
+                                               flip_y=not args.no_flip_y, max_distance=args.match_distance)
+            write_table(matches, f"{args.output}/matches.{args.format}", args.format)
+            write_table(summaries, f"{args.output}/match_summary.{args.format}", args.format)
+            print_match_summaries(summaries)
 
-    del wb["Sheet"]
-    wb.save(f"{output_folder}/data.xlsx")
\ No newline at end of file
+        print(f"Analyzed {len(results)} of {len(image_paths)} images")
+        for name, error in failures.items():
+            print(f"  {name} failed: {error}")
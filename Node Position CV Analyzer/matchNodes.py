@@ -0,0 +1,163 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+MAX_MATCH_DISTANCE = 2.0    # mm, detected nodes further than this from every design node are left unmatched
+MATCH_CANDIDATES = 8        # nearest design nodes each detected node can be matched to
+ICP_ITERATIONS = 50
+ICP_TOLERANCE = 1e-6        # mm, registration stops once the mean residual changes less than this
+ROTATION_CANDIDATES = 8     # starting rotations registration is tried from, see rotation_candidates
+NEIGHBOURS = 4              # neighbours per node whose directions are compared to find the starting rotations
+
+# reads the design node positions (in mm) from the Nodes sheet of a network workbook, or a *_Nodes.csv/parquet table
+# design node numbers start at 1, same as EndNodes_1/EndNodes_2 in the Edges sheet
+def load_design_nodes(path):
+    path = Path(path)
+    if path.suffix in ['.xlsx', '.xls']:
+        node_df = pd.read_excel(path, sheet_name='Nodes')
+    elif path.suffix == '.csv':
+        node_df = pd.read_csv(path)
+    elif path.suffix == '.parquet':
+        node_df = pd.read_parquet(path)
+    else:
+        raise Exception(f"ERROR: Unsupported design file {path.name}, must be a workbook with a Nodes sheet or a csv/parquet nodes table.")
+    return node_df[['x', 'y']].to_numpy(dtype=float)
+
+# returns the (scale, rotation matrix, translation) that best maps the src points onto the dst points in the least squares sense
+# (Umeyama's method), the scale is fixed to 1 unless with_scale is true
+def fit_transform(src, dst, with_scale=False):
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    src_centered, dst_centered = src - src_mean, dst - dst_mean
+    U, S, Vt = np.linalg.svd(dst_centered.T @ src_centered / len(src))
+    D = np.eye(2)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        D[1, 1] = -1    # keeps the rotation from turning into a reflection
+    R = U @ D @ Vt
+    scale = np.trace(np.diag(S) @ D) / (src_centered ** 2).sum(axis=1).mean() if with_scale else 1.0
+    return scale, R, dst_mean - scale * R @ src_mean
+
+def apply_transform(transform, points):
+    scale, R, t = transform
+    return scale * points @ R.T + t
+
+# returns a histogram (one bin per degree) of the directions from every point to its nearest neighbours
+def direction_histogram(points):
+    k = min(NEIGHBOURS + 1, len(points))
+    _, nearest = cKDTree(points).query(points, k=k)
+    vectors = points[nearest[:, 1:]] - points[:, None, :]
+    angles = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0])).ravel() % 360
+    histogram = np.bincount(angles.astype(int) % 360, minlength=360).astype(float)
+    return np.convolve(np.concatenate([histogram[-2:], histogram, histogram[:2]]), np.ones(5) / 5, mode='valid')    # circular smoothing
+
+# returns the count rotations (degrees) that best line up the neighbour directions of the detected nodes with those of the design,
+# found by circular cross correlation of their direction histograms, so registration starts close to the right orientation
+def rotation_candidates(detected, design, count=ROTATION_CANDIDATES):
+    correlation = np.real(np.fft.ifft(np.fft.fft(direction_histogram(design)) * np.conj(np.fft.fft(direction_histogram(detected)))))
+    peaks = np.flatnonzero((correlation >= np.roll(correlation, 1)) & (correlation >= np.roll(correlation, -1)))
+    return peaks[np.argsort(-correlation[peaks], kind='stable')][:count].tolist()
+
+# registers the detected node positions onto the design with iterative closest point, starting from each of rotation_candidates
+# the detected y axis is flipped first if flip_y is true, since image rows grow downwards
+# pairs further apart than max(max_distance, 3 x the median pair distance) are left out of each fit, so spurious detections don't pull the fit
+# returns the transform (see fit_transform) from detected to design coordinates with the lowest total distance, capped at max_distance per node
+def register(detected, design, with_scale=False, flip_y=True, max_distance=MAX_MATCH_DISTANCE, design_tree=None):
+    detected = np.asarray(detected, dtype=float) * ([1, -1] if flip_y else [1, 1])
+    design = np.asarray(design, dtype=float)
+    tree = cKDTree(design) if design_tree is None else design_tree
+
+    best, best_score = None, None
+    for angle in rotation_candidates(detected, design):
+        theta = np.radians(angle)
+        R = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+        transform = (1.0, R, design.mean(axis=0) - R @ detected.mean(axis=0))
+        previous = np.inf
+        for _ in range(ICP_ITERATIONS):
+            distance, nearest = tree.query(apply_transform(transform, detected))
+            keep = distance <= max(max_distance, 3 * np.median(distance))
+            if keep.sum() < 3:
+                break
+            transform = fit_transform(detected[keep], design[nearest[keep]], with_scale)
+            if abs(previous - distance[keep].mean()) < ICP_TOLERANCE:
+                break
+            previous = distance[keep].mean()
+
+        # nodes further than max_distance count as max_distance, so spurious detections can't dominate the score
+        distance, _ = tree.query(apply_transform(transform, detected))
+        score = np.minimum(distance, max_distance).sum()
+        if best_score is None or score < best_score:
+            best, best_score = transform, score
+
+    # folds the y flip into the returned transform so it applies to the detected positions as given
+    scale, R, t = best
+    if flip_y:
+        R = R @ np.diag([1, -1])
+    return scale, R, t
+
+# matches detected nodes one to one with design nodes after registering them (see register)
+# each detected node is only considered for its MATCH_CANDIDATES nearest design nodes within max_distance (found with a kd-tree),
+# and the assignment minimizing the total distance is solved on that sparse graph, where leaving a node unmatched costs max_distance
+# returns a table with a row per detected and per unmatched design node, and a dict of summary statistics
+def match_nodes(detected, design, with_scale=False, flip_y=True, max_distance=MAX_MATCH_DISTANCE):
+    detected = np.asarray(detected, dtype=float).reshape(-1, 2)
+    design = np.asarray(design, dtype=float).reshape(-1, 2)
+    if len(detected) < 3 or len(design) < 3:
+        raise Exception("ERROR: At least 3 detected and 3 design nodes are needed to match them.")
+    tree = cKDTree(design)
+    transform = register(detected, design, with_scale=with_scale, flip_y=flip_y, max_distance=max_distance, design_tree=tree)
+    moved = apply_transform(transform, detected)
+
+    # candidate edges, zero distances are nudged up since the sparse graph drops zero weights
+    k = min(MATCH_CANDIDATES, len(design))
+    distance, nearest = tree.query(moved, k=k, distance_upper_bound=max_distance)
+    distance, nearest = distance.reshape(len(detected), k), nearest.reshape(len(detected), k)
+    valid = np.isfinite(distance)
+    eps = max_distance * 1e-9
+    rows = np.concatenate([np.repeat(np.arange(len(detected)), k)[valid.ravel()], np.arange(len(detected))])
+    cols = np.concatenate([nearest[valid], len(design) + np.arange(len(detected))])    # one dummy design node per detected node
+    weights = np.concatenate([distance[valid] + eps, np.full(len(detected), max_distance + eps)])
+    graph = csr_matrix((weights, (rows, cols)), shape=(len(detected), len(design) + len(detected)))
+    _, assigned = min_weight_full_bipartite_matching(graph)
+    matched = assigned < len(design)
+
+    node = np.full(len(detected), -1)
+    node[matched] = assigned[matched]
+    return match_report(moved, design, node, transform)
+
+# returns the match of an image whose nodes couldn't be registered to the design, with nothing matched and every design node unmatched
+def unmatched_report(detected, design):
+    detected = np.asarray(detected, dtype=float).reshape(-1, 2)
+    design = np.asarray(design, dtype=float).reshape(-1, 2)
+    return match_report(np.full(detected.shape, np.nan), design, np.full(len(detected), -1), None)
+
+# builds the match table and summary of match_nodes from the registered node positions, the design node (starting at 0) each was
+# matched to or -1, and the registration transform, which is None if the nodes couldn't be registered
+def match_report(moved, design, node, transform):
+    matched = node >= 0
+    unmatched_design = np.setdiff1d(np.arange(len(design)), node[matched])
+
+    table = pd.DataFrame({'index': np.arange(len(moved)), 'node': np.where(matched, node + 1, -1),
+                          'x_mm': moved[:, 0], 'y_mm': moved[:, 1]})
+    table['design_x_mm'] = np.where(matched, design[node, 0], np.nan)
+    table['design_y_mm'] = np.where(matched, design[node, 1], np.nan)
+    missing = pd.DataFrame({'index': -1, 'node': unmatched_design + 1, 'x_mm': np.nan, 'y_mm': np.nan,
+                            'design_x_mm': design[unmatched_design, 0], 'design_y_mm': design[unmatched_design, 1]})
+    table = pd.concat([table, missing], ignore_index=True)
+    table['dx_mm'] = table['x_mm'] - table['design_x_mm']
+    table['dy_mm'] = table['y_mm'] - table['design_y_mm']
+    table['error_mm'] = np.hypot(table['dx_mm'], table['dy_mm'])
+
+    error = table['error_mm'].dropna().to_numpy()
+    scale, R, t = transform if transform is not None else (np.nan, np.full((2, 2), np.nan), np.full(2, np.nan))
+    summary = {'detected': len(moved), 'design': len(design), 'matched': int(matched.sum()),
+               'unmatched_detected': int((~matched).sum()), 'unmatched_design': len(unmatched_design),
+               'mean_error_mm': float(error.mean()) if len(error) else np.nan,
+               'rms_error_mm': float(np.sqrt((error ** 2).mean())) if len(error) else np.nan,
+               'median_error_mm': float(np.median(error)) if len(error) else np.nan,
+               'p95_error_mm': float(np.percentile(error, 95)) if len(error) else np.nan,
+               'max_error_mm': float(error.max()) if len(error) else np.nan,
+               'scale': float(scale), 'rotation_deg': float(np.degrees(np.arctan2(R[1, 0], R[0, 0]))),
+               'translation_x_mm': float(t[0]), 'translation_y_mm': float(t[1])}
+    return table, summary
@@ -1,72 +1,178 @@
-import cv2 
+import cv2
 from pathlib import Path
 import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))    # the repo folder, for the modules the analyzers share
+from watchFolder import append_csv, poll_folder
 
 # SCALE_FACTOR (pixels per mm)
 SCALE_FACTOR = 41.9
+MIN_AREA = 100  # Minimum area of a sample in pixels
 
-def analyze(image_path, outpath):
-    # Load the image 
-    img = cv2.imread(image_path) 
+OUTPUT_FORMATS = ['csv', 'parquet']     # formats the batch results can be written in
+MEASUREMENT_COLUMNS = ["index", "x_mm", "y_mm", "w_mm", "h_mm", "angle_deg", "area_mm2"]
+DECIMALS = 3    # every measurement is rounded to this many decimals
 
-    # Convert the image to grayscale 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) 
-    cv2.imwrite("grayscale_output.jpg", gray)    
+# measures every sample in an image and draws its bounding box and dimensions on it if annotate is true
+# returns the thresholded grayscale image and a list with a tuple of MEASUREMENT_COLUMNS per sample, w is always the shorter side
+# and angle_deg is the angle of the w side in [0, 180) as cv2.minAreaRect measures it
+def measure_samples(img, annotate=True):
+    # Convert the image to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    # Apply a threshold to the image to 
+    # Apply a threshold to the image to
     # separate the objects from the background
-    ret, thresh = cv2.threshold( 
+    ret, thresh = cv2.threshold(
         gray, 0, 255, cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU)
 
-    cv2.imwrite("threshhold_output.jpg", thresh)    
-
-    # Find the contours of the objects in the image 
+    # Find the contours of the objects in the image
     contours, hierarchy = cv2.findContours(
         thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    # Loop through the contours and calculate the area of each object 
-    for cnt in contours: 
-        area = cv2.contourArea(cnt) 
-        if area < 100: 
+    # Loop through the contours and calculate the area of each object
+    samples = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < MIN_AREA:
             continue
-        # Draw a bounding box around each 
-        # object and display the dimensions on the image 
-        rect = cv2.minAreaRect(cnt) 
-        box = cv2.boxPoints(rect)
-        box = np.intp(box)
+        rect = cv2.minAreaRect(cnt)
         (x, y), (w, h), angle = rect
         # print(f"x: {x}, y: {y}, w: {w}, h: {h}, angle: {angle}")
-        cv2.drawContours(img,[box],0,(0,255,0),2)
-
-        # makes sure height is greater than width
-        if h < w: 
-            w, h = h, w            
-        
-        cv2.putText(img, f"w: {w/SCALE_FACTOR:.3f}", (int(x), int(y)), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2) 
-        cv2.putText(img, f"h: {h/SCALE_FACTOR:.3f}", (int(x), int(y-40)), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2) 
-
-    # Show the final image with the bounding boxes 
-    # and areas of the objects overlaid on top 
-    # cv2.imshow('image', img)
-    # cv2.waitKey(0)
-    # cv2.destroyAllWindows()
-
-    cv2.putText(img, f"Filename: {image_path.split('/')[-1]}", (100, 100), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10) 
-    cv2.putText(img, f"Scale Factor: {SCALE_FACTOR}", (100, 200), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10) 
-
-    # Save the final image to output folder
-    cv2.imwrite(outpath, img)    
+
+        # makes sure height is greater than width, the w side is then cv2's height side which is at a right angle to its width side
+        if h < w:
+            w, h = h, w
+            angle += 90
+
+        samples.append((len(samples), *(round(value, DECIMALS) for value in (x/SCALE_FACTOR, y/SCALE_FACTOR, w/SCALE_FACTOR, h/SCALE_FACTOR, angle % 180, area/SCALE_FACTOR**2))))
+
+        # Draw a bounding box around each
+        # object and display the dimensions on the image
+        if annotate:
+            box = np.intp(cv2.boxPoints(rect))
+            cv2.drawContours(img,[box],0,(0,255,0),2)
+            cv2.putText(img, f"w: {w/SCALE_FACTOR:.3f}", (int(x), int(y)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
+            cv2.putText(img, f"h: {h/SCALE_FACTOR:.3f}", (int(x), int(y-40)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
+    return gray, thresh, samples
+
+# measures a single image and returns its result, a dict with the image name and its samples (see measure_samples)
+# the annotated image is written to outpath if it is given, through image_writer (an executor) if one is given
+# if debug_folder is given, the grayscale and thresholded images are written there too
+def analyze_image(image_path, outpath=None, debug_folder=None, image_writer=None):
+    image_path = Path(image_path)
+    # Load the image
+    img = cv2.imread(str(image_path))
+    if img is None:
+        raise Exception(f"ERROR: Could not read the image {image_path}.")
+    gray, thresh, samples = measure_samples(img, annotate=outpath is not None)
+
+    write = cv2.imwrite if image_writer is None else lambda *args: image_writer.submit(cv2.imwrite, *args)
+    if debug_folder is not None:
+        write(f"{debug_folder}/{image_path.stem}_grayscale.jpg", gray)
+        write(f"{debug_folder}/{image_path.stem}_threshold.jpg", thresh)
+
+    if outpath is not None:
+        cv2.putText(img, f"Filename: {image_path.name}", (100, 100),
+                        cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10)
+        cv2.putText(img, f"Scale Factor: {SCALE_FACTOR}", (100, 200),
+                        cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 10)
+
+        # Save the final image to output folder
+        write(str(outpath), img)
+    return {'image': image_path.stem, 'samples': samples}
+
+# measures an image and writes the annotated image to outpath, returns the samples (see measure_samples)
+def analyze(image_path, outpath):
+    return analyze_image(image_path, outpath)['samples']
+
+# measures every image, over a pool of worker processes if workers > 1 (None uses every CPU)
+# annotated images are written to the output folder if annotate is true, and the grayscale and thresholded images if debug is true
+# in serial runs the images are written by a background thread while the next image is measured
+# an image that fails is reported and skipped instead of stopping the batch
+# returns the results of the images that succeeded in input order (see analyze_image) and a dict of image name to error message
+def analyze_batch(image_paths, output_folder, workers=1, annotate=True, debug=False):
+    jobs = [(image_path, f"{output_folder}/{Path(image_path).stem}_analyzed.jpg" if annotate else None, output_folder if debug else None)
+            for image_path in image_paths]
+    results = []
+    failures = {}
+    if workers == 1:
+        with ThreadPoolExecutor(max_workers=1) as image_writer:
+            for image_path, outpath, debug_folder in jobs:
+                print("Analyzing", image_path)
+                try:
+                    results.append(analyze_image(image_path, outpath, debug_folder, image_writer=image_writer))
+                except Exception as e:
+                    failures[Path(image_path).name] = f"{type(e).__name__}: {e}"
+                    print(f"Failed to analyze {image_path}. Skipping...")
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(analyze_image, *job) for job in jobs]
+        for (image_path, _, _), future in zip(jobs, futures):  # results are collected in input order
+            try:
+                results.append(future.result())
+                print("Analyzed", image_path)
+            except Exception as e:
+                failures[Path(image_path).name] = f"{type(e).__name__}: {e}"
+                print(f"Failed to analyze {image_path}. Skipping...")
+    return results, failures
+
+# returns the results of analyze_batch as one table with a row per sample
+def results_table(results):
+    rows = [(result['image'], *sample) for result in results for sample in result['samples']]
+    return pd.DataFrame(rows, columns=["image"] + MEASUREMENT_COLUMNS)
+
+# writes the results of analyze_batch to outpath as a table with a row per sample, the format is one of OUTPUT_FORMATS
+def write_results(results, outpath, output_format='csv'):
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"ERROR: Output format must be one of {OUTPUT_FORMATS}.")
+    if output_format == 'csv':
+        results_table(results).to_csv(outpath, index=False)
+    else:
+        results_table(results).to_parquet(outpath, index=False)
+
+# watches the input folder and measures new or changed images as they arrive (see poll_folder)
+# measurements are appended to measurements.csv once every image of a poll is done
+# runs until interrupted, or for max_polls polls if given, and returns the number of images measured
+def watch(input_folder, output_folder, interval=2.0, workers=1, annotate=True, debug=False, max_polls=None):
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    def process(image_paths):
+        results, failures = analyze_batch(image_paths, output_folder, workers=workers, annotate=annotate, debug=debug)
+        append_csv(results_table(results), output_folder / "measurements.csv")
+        return failures
+
+    measured = poll_folder(input_folder, output_folder, process, interval=interval, max_polls=max_polls)
+    print(f"Measured {measured} new images")
+    return measured
 
 if __name__ == '__main__':
-    input_folder = '/Users/jaredmyang/Documents/GitHub/RML-gcode-generator/CV Measurer/input'
-    output_folder = '/Users/jaredmyang/Documents/GitHub/RML-gcode-generator/CV Measurer/output'
-
-    # loop through all the images in the input folder using pathlib
-    for file in Path(input_folder).iterdir():
-        if file.is_file() and file.suffix == '.JPG':
-            print("Analyzing", file)
-            analyze(image_path=str(file), outpath=f"{output_folder}/{file.stem}_analyzed.jpg")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Measures the samples in every image in the input folder.")
+    parser.add_argument('--input', type=Path, default=Path(__file__).parent / "input", help="folder with the *.JPG images")
+    parser.add_argument('--output', type=Path, default=Path(__file__).parent / "output", help="folder the measurements and annotated images are written to")
+    parser.add_argument('--workers', type=int, default=1, help="number of images to measure in parallel")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv', help="format of the measurements file")
+    parser.add_argument('--no-annotate', action='store_true', help="don't write the annotated images")
+    parser.add_argument('--debug-images', action='store_true', help="also write the grayscale and thresholded images")
+    parser.add_argument('--watch', action='store_true', help="keep watching the input folder and measure new images as they arrive, appending to measurements.csv")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between polls of the input folder when watching")
+    args = parser.parse_args()
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    if args.watch:
+        watch(args.input, args.output, interval=args.interval, workers=args.workers, annotate=not args.no_annotate, debug=args.debug_images)
+    else:
+        # loop through all the images in the input folder using pathlib
+        image_paths = sorted(Path(args.input).glob("*.JPG"))
+        results, failures = analyze_batch(image_paths, args.output, workers=args.workers, annotate=not args.no_annotate, debug=args.debug_images)
+        write_results(results, f"{args.output}/measurements.{args.format}", args.format)
+
+        print(f"Measured {len(results)} of {len(image_paths)} images")
+        for name, error in failures.items():
+            print(f"  {name} failed: {error}")
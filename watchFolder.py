@@ -0,0 +1,76 @@
+from pathlib import Path
+import hashlib
+import json
+import time
+
+# folder watching shared by the CV analyzers, each of them imports it with the repo folder on the path
+
+STATE_NAME = '.processed.json'  # file in the output folder that records the content hash of every image a watch has processed
+
+# returns the sha256 hex digest of a file
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# appends a table to a csv file, only writing the header if the file is new
+def append_csv(df, path):
+    df.to_csv(path, mode='a', header=not Path(path).exists(), index=False)
+
+# polls the input folder every interval seconds and calls process with the list of *.JPG images that are new or changed since they were last processed
+# images are tracked by content hash in STATE_NAME in the output folder, so a restarted watch skips everything it already processed
+# an image is only picked up once its size and modification time are the same on two polls in a row, so half written files are left alone
+# process writes its output and returns the names of the images that failed, the state file is saved right after so the two stay in step
+# images that failed, and every image of a poll whose process raised, are retried only once they change
+# runs until interrupted, or for max_polls polls if given, and returns the number of images processed
+def poll_folder(input_folder, output_folder, process, interval=2.0, max_polls=None):
+    state_path = Path(output_folder) / STATE_NAME
+    processed = {}  # content hash -> image name
+    if state_path.exists():
+        with open(state_path) as fd:
+            processed = json.load(fd)
+
+    stats = {}      # image path -> (size, modification time) at the previous poll
+    hashes = {}     # image path -> (size, modification time) and content hash, so unchanged images aren't hashed again
+    failed = set()  # content hashes of images that failed
+    count = 0
+    polls = 0
+    print(f"Watching {input_folder} for new images, press Ctrl+C to stop")
+    try:
+        while max_polls is None or polls < max_polls:
+            polls += 1
+            previous_stats, stats = stats, {}
+            ready = {}
+            for image_path in sorted(Path(input_folder).glob("*.JPG")):
+                stat = image_path.stat()
+                stats[image_path] = (stat.st_size, stat.st_mtime_ns)
+                if previous_stats.get(image_path) != stats[image_path]:
+                    continue    # new or still being written
+                if hashes.get(image_path, (None,))[0] != stats[image_path]:
+                    hashes[image_path] = (stats[image_path], hash_file(image_path))
+                digest = hashes[image_path][1]
+                if digest not in processed and digest not in failed:
+                    ready[image_path] = digest
+
+            if ready:
+                try:
+                    failures = process(list(ready))
+                except Exception as e:
+                    print(f"Failed to process {len(ready)} new images ({type(e).__name__}: {e}). Skipping them until they change...")
+                    failures = [image_path.name for image_path in ready]
+                for image_path, digest in ready.items():
+                    if image_path.name in failures:
+                        failed.add(digest)
+                    else:
+                        processed[digest] = image_path.name
+                        count += 1
+                with open(state_path, 'w') as fd:
+                    json.dump(processed, fd, indent=4)
+
+            if max_polls is None or polls < max_polls:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return count